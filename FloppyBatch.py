@@ -0,0 +1,270 @@
+#!/bin/env python3
+"""Headless batch imaging
+
+Reads a manifest (CSV or YAML) describing a batch of disks into a job queue
+kept in a SQLite database next to the manifest, and then images them one
+after another, prompting on the terminal for each disk.  The queue keeps
+the status of every disk, so the batch can be stopped and restarted and it
+will carry on with the disks that haven't been done yet.
+
+Manifest columns / keys:
+    drive       the configured drive to read with
+    format      the disk format or 'probe' to figure it out
+    output      the image file, the extension is added if it's missing
+    label       optional, what to call the disk when asking for it
+    track_min, track_max, head_min, head_max   optional limits
+"""
+import argparse
+import csv
+from datetime import datetime
+import logging
+from pathlib import Path
+import sqlite3
+import sys
+import yaml
+
+from checkpoint import checkpoint_file
+from floppy import FloppyReader, best_format, drive_name, track_log_entry
+from telemetry import load_summary
+
+
+STATUSES = ('pending', 'running', 'done', 'errors', 'failed', 'skipped', 'duplicate')
+
+SCHEMA = """
+create table if not exists jobs (
+    id integer primary key,
+    drive text not null,
+    format text not null,
+    output text not null unique,
+    label text,
+    track_min integer,
+    track_max integer,
+    head_min integer,
+    head_max integer,
+    status text not null default 'pending',
+    detected_format text,
+    image text,
+    message text,
+    started text,
+    finished text
+)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image a batch of floppy disks without the GUI")
+    parser.add_argument("--config", default=Path(sys.path[0], "FloppyDiskReader.conf"), type=Path, help="Configuration file")
+    parser.add_argument("--debug", default=False, action="store_true", help="Enable debug logging")
+    parser.add_argument("--queue", type=Path, help="Job queue database (default: <manifest>.queue)")
+    parser.add_argument("--no-prompt", default=False, action="store_true", help="Don't wait for each disk to be inserted")
+    parser.add_argument("--retry", default=False, action="store_true", help="Requeue disks that failed or had errors")
+    parser.add_argument("--status", default=False, action="store_true", help="Show the queue and exit")
+    parser.add_argument("--deferred", default=False, action="store_true", help="Read the whole disk before retrying bad tracks")
+    parser.add_argument("--sparse", default=False, action="store_true", help="Only read the tracks the filesystem is using")
+    parser.add_argument("--time-budget", type=float, help="Stop retrying bad tracks after this many seconds per disk")
+    parser.add_argument("--duplicates", choices=('ask', 'skip', 'read'), default='ask',
+                        help="What to do with disks that have already been imaged (ask only when prompting)")
+    parser.add_argument("manifest", type=Path, help="CSV or YAML manifest of the disks to image")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    queue = JobQueue(args.queue or args.manifest.with_name(args.manifest.name + ".queue"))
+    added = queue.load_manifest(args.manifest)
+    if added:
+        logging.info(f"Added {added} disks from {args.manifest}")
+    if args.retry:
+        queue.requeue(('failed', 'errors'))
+
+    if args.status:
+        queue.show()
+        return 0
+
+    floppy = FloppyReader(args.config)
+    runner = BatchRunner(floppy, queue, prompt=not args.no_prompt,
+                         deferred=args.deferred, sparse=args.sparse, time_budget=args.time_budget,
+                         duplicates=args.duplicates)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        print("\nStopped, run again to carry on with the rest of the batch")
+        return 1
+    finally:
+        floppy.close()
+        queue.show()
+    return 0
+
+
+class JobQueue:
+    """The persistent list of disks to image and how each of them went"""
+    def __init__(self, filename: Path):
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(SCHEMA)
+            # anything that was running when we were stopped has to be redone
+            self.db.execute("update jobs set status='pending', started=null where status='running'")
+
+
+    def load_manifest(self, manifest: Path) -> int:
+        """Add the disks in the manifest that aren't already queued"""
+        if manifest.suffix.lower() in ('.yaml', '.yml'):
+            with open(manifest) as f:
+                rows = yaml.safe_load(f) or []
+            if isinstance(rows, dict):
+                rows = rows.get('disks', [])
+        else:
+            with open(manifest, newline='') as f:
+                rows = list(csv.DictReader(f))
+
+        added = 0
+        with self.db:
+            for i, row in enumerate(rows, 1):
+                row = {k.strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+                for k in ('drive', 'format', 'output'):
+                    if not row.get(k):
+                        raise ValueError(f"{manifest}: disk {i} is missing '{k}'")
+                limits = {k: int(row[k]) if row.get(k) not in (None, '') else None
+                          for k in ('track_min', 'track_max', 'head_min', 'head_max')}
+                cur = self.db.execute("""insert or ignore into jobs
+                                         (drive, format, output, label, track_min, track_max, head_min, head_max)
+                                         values (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                      (drive_name(row['drive']), row['format'], str(row['output']),
+                                       row.get('label') or None, limits['track_min'], limits['track_max'],
+                                       limits['head_min'], limits['head_max']))
+                added += cur.rowcount
+        return added
+
+
+    def next(self):
+        return self.db.execute("select * from jobs where status='pending' order by id limit 1").fetchone()
+
+
+    def update(self, job_id: int, **values):
+        cols = ', '.join(f"{k}=?" for k in values)
+        with self.db:
+            self.db.execute(f"update jobs set {cols} where id=?", (*values.values(), job_id))
+
+
+    def requeue(self, statuses: tuple):
+        with self.db:
+            self.db.execute(f"update jobs set status='pending' where status in ({','.join('?' * len(statuses))})", statuses)
+
+
+    def show(self):
+        counts = dict(self.db.execute("select status, count(*) from jobs group by status").fetchall())
+        for row in self.db.execute("select * from jobs where status != 'pending' order by id"):
+            print(f"{row['id']:5d} {row['status']:8s} {row['label'] or row['output']}: {row['message'] or ''}")
+        print(", ".join(f"{s}: {counts[s]}" for s in STATUSES if s in counts))
+
+
+class BatchRunner:
+    """Work through the queue, one disk at a time"""
+    def __init__(self, floppy: FloppyReader, queue: JobQueue, prompt: bool=True,
+                 deferred: bool=False, sparse: bool=False, time_budget: float=None, duplicates: str='ask'):
+        self.floppy = floppy
+        self.queue = queue
+        self.prompt = prompt
+        self.deferred = deferred
+        self.sparse = sparse
+        self.time_budget = time_budget
+        self.duplicates = duplicates
+
+
+    def wait_for_disk(self, job) -> str:
+        """Ask the operator for the disk.  Returns 'go', 'skip' or 'quit'"""
+        if not self.prompt:
+            return 'go'
+        answer = input(f"Insert {job['label'] or job['output']} into drive {job['drive']} "
+                       "and press Enter (s to skip, q to quit): ").strip().lower()
+        return {'s': 'skip', 'q': 'quit'}.get(answer[:1], 'go')
+
+
+    def run(self):
+        while (job := self.queue.next()) is not None:
+            action = self.wait_for_disk(job)
+            if action == 'quit':
+                return
+            if action == 'skip':
+                self.queue.update(job['id'], status='skipped', message='skipped by operator')
+                continue
+            self.queue.update(job['id'], status='running', started=datetime.now().isoformat(timespec='seconds'))
+            try:
+                status, message, values = self.image(job)
+            except Exception as e:
+                logging.exception(e)
+                self.floppy.reset()
+                status, message, values = 'failed', str(e), {}
+            self.queue.update(job['id'], status=status, message=message,
+                              finished=datetime.now().isoformat(timespec='seconds'), **values)
+            print(f"{job['label'] or job['output']}: {status}, {message}")
+
+
+    def image(self, job) -> tuple[str, str, dict]:
+        """Image the disk for the job, returning the status, a message and
+        any other values to record in the queue"""
+        drive = job['drive']
+        format = job['format']
+        values = {}
+        if format.lower() == 'probe':
+            probed = self.floppy.probe(drive)
+            if not probed:
+                return 'failed', 'no format could be found', values
+            format = best_format(probed)
+            values['detected_format'] = format
+            logging.info(f"Probed {drive} as {format}: {probed[format]}")
+
+        output = Path(job['output'])
+        if not output.suffix:
+            output = output.with_name(output.name + self.floppy.get_extension_for_format(format))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        values['image'] = str(output)
+
+        limits = {k: job[k] for k in ('track_min', 'track_max', 'head_min', 'head_max') if job[k] is not None}
+        bad_tracks = 0
+        duplicate_of = None
+
+        def duplicate_found(matches) -> bool:
+            nonlocal duplicate_of
+            original = matches[0]['image']
+            if self.duplicates == 'ask' and self.prompt:
+                print(file=sys.stderr)
+                answer = input(f"{output.name} looks like a copy of {original}, skip it? [Y/n] ").strip().lower()
+                stop = not answer.startswith('n')
+            else:
+                stop = self.duplicates == 'skip'
+            if stop:
+                duplicate_of = original
+            return stop
+
+        resuming = checkpoint_file(output).exists()
+        with open(output.parent / (output.name + ".log"), "a" if resuming else "w") as log:
+            def callback(message):
+                nonlocal bad_tracks
+                log.write(track_log_entry(message))
+                if not message['success'] and not message['retry']:
+                    bad_tracks += 1
+                print(f"\r{output.name}: {100 * message['progress']:5.1f}%", end='', file=sys.stderr, flush=True)
+                return False
+
+            # a disk that was interrupted last time picks up from its checkpoint
+            completed = self.floppy.read_image(drive, format, output, callback=callback, pipelined=True,
+                                               resume=True, deferred=self.deferred, sparse=self.sparse,
+                                               time_budget=self.time_budget,
+                                               duplicate_callback=None if self.duplicates == 'read' else duplicate_found,
+                                               **limits)
+            print(file=sys.stderr)
+
+        if duplicate_of:
+            values['image'] = None
+            return 'duplicate', f"probable copy of {duplicate_of}", values
+        if not completed:
+            return 'failed', 'read did not complete', values
+        summary = load_summary(output)
+        speed = f", {summary['tracks_per_s']:.2f} tracks/s" if summary else ''
+        if bad_tracks:
+            return 'errors', f"{format}: {bad_tracks} tracks with bad sectors{speed}", values
+        return 'done', f"{format}{speed}", values
+
+
+if __name__ == "__main__":
+    sys.exit(main())
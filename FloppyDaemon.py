@@ -0,0 +1,374 @@
+#!/bin/env python3
+"""Reader daemon
+
+Keeps the FloppyReader, and with it the greaseweazles, open in one long
+running process and takes requests from any number of local clients over
+a Unix socket, so ingest scripts and GUIs can share the hardware and don't
+have to wait for the greaseweazle to be opened every time.
+
+The protocol is JSON lines.  Each request is an object with an 'op' and
+its arguments, and is answered with an object that has 'ok' (and 'error'
+when it's false).  probe, read, verify and rpm are queued as jobs on the drive's
+greaseweazle and answered with the job's id straight away.  Unless the
+request has "watch": false, the job's progress messages then follow as
+{"event": "progress", ...} objects and finally {"event": "done", ...} with
+the job's result.
+
+    {"op": "status"}
+    {"op": "formats", "drive": "A"}
+    {"op": "probe", "drive": "A"}
+    {"op": "read", "drive": "A", "format": "ibm.1440", "filename": "/abs/path.img", ...}
+    {"op": "verify", "drive": "A", "format": "ibm.1440", "filename": "/abs/path.img", ...}
+    {"op": "rpm", "drive": "A"}
+    {"op": "watch", "job": 3}
+    {"op": "cancel", "job": 3}
+
+The read and verify arguments are the same as FloppyReader.read_image and
+verify_image.  This module
+is also the client:  `FloppyDaemon.py serve` starts the daemon and the
+other commands send it requests.
+"""
+import argparse
+from collections import deque
+import json
+import logging
+import os
+from pathlib import Path
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from floppy import FloppyReader, drive_name
+from scheduler import Job, UnitScheduler
+
+
+SOCKET = Path(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), f"FloppyDiskReader-{os.getuid()}.sock")
+# progress messages kept for each job, for clients that start watching late
+HISTORY = 1000
+# finished jobs are kept for this many seconds, and only the most recent ones
+FINISHED_TTL = 3600
+FINISHED_KEEP = 100
+READ_OPTIONS = ('track_min', 'track_max', 'head_min', 'head_max', 'max_retries', 'pipelined',
+                'adaptive', 'flux_file', 'resume', 'deferred', 'time_budget', 'telemetry',
+                'manifest', 'sparse', 'catalog')
+VERIFY_OPTIONS = ('track_min', 'track_max', 'head_min', 'head_max', 'max_retries', 'max_errors')
+
+
+class DaemonJob:
+    """A scheduler job and the progress messages it has sent"""
+    def __init__(self):
+        self.job: Job = None
+        self.events = deque(maxlen=HISTORY)
+        self.sent = 0
+        self.cancelled = False
+        self.done = False
+        self.result = None
+        self.error: str = None
+        self.changed = threading.Condition()
+
+
+    def callback(self, message) -> bool:
+        with self.changed:
+            # a plain copy, so the history doesn't keep the captures alive
+            self.events.append(dict(message))
+            self.sent += 1
+            self.changed.notify_all()
+        return self.cancelled
+
+
+    def finished(self, future):
+        with self.changed:
+            if future.cancelled():
+                self.error = 'cancelled'
+                self.events.append({'success': False, 'message': 'cancelled before it started', 'progress': 0})
+                self.sent += 1
+            elif future.exception() is not None:
+                self.error = str(future.exception())
+            else:
+                self.result = future.result()
+                if self.cancelled:
+                    self.job.status = 'cancelled'
+            self.done = True
+            self.changed.notify_all()
+
+
+    def describe(self) -> dict:
+        job = self.job
+        return {'job': job.id, 'operation': job.operation, 'drive': job.drive, 'status': job.status,
+                'submitted': job.submitted, 'started': job.started, 'finished': job.finished,
+                'progress': self.events[-1].get('progress') if self.events else 0}
+
+
+class Daemon:
+    def __init__(self, floppy: FloppyReader):
+        self.floppy = floppy
+        self.scheduler = UnitScheduler(floppy)
+        self.jobs: dict[int, DaemonJob] = {}
+        self.jobs_lock = threading.Lock()
+        self.started = time.time()
+
+
+    def submit(self, operation: str, drive: str, *args, **kwargs) -> DaemonJob:
+        djob = DaemonJob()
+        if operation != 'rpm':
+            kwargs['callback'] = djob.callback
+        djob.job = self.scheduler.submit(operation, drive, *args, **kwargs)
+        djob.job.future.add_done_callback(djob.finished)
+        with self.jobs_lock:
+            self.jobs[djob.job.id] = djob
+        self.expire()
+        return djob
+
+
+    def expire(self):
+        "Forget the jobs that finished too long ago, or too many jobs ago"
+        with self.jobs_lock:
+            done = sorted((j for j in self.jobs.values() if j.done), key=lambda j: j.job.finished or 0)
+            old = time.time() - FINISHED_TTL
+            # oldest first, so everything before the ones being kept goes
+            keep = max(0, len(done) - FINISHED_KEEP)
+            for i, djob in enumerate(done):
+                if i >= keep and (djob.job.finished or 0) >= old:
+                    break
+                del self.jobs[djob.job.id]
+                self.scheduler.forget(djob.job)
+
+
+    def handle(self, request: dict, send) -> None:
+        "Answer a request, sending the responses with send()"
+        op = request.get('op')
+        if op == 'status':
+            self.expire()
+            with self.jobs_lock:
+                jobs = [j.describe() for j in self.jobs.values()]
+            send({'ok': True, 'uptime': round(time.time() - self.started, 1),
+                  'drives': {d: p['type'] for d, p in self.floppy.drives.items()},
+                  'jobs': jobs})
+        elif op == 'formats':
+            send({'ok': True, 'formats': list(self.floppy.get_formats_for_drive(request['drive']))})
+        elif op in ('probe', 'read', 'verify', 'rpm'):
+            drive = request['drive']
+            if op in ('read', 'verify'):
+                filename = Path(request['filename'])
+                if not filename.is_absolute():
+                    raise ValueError("The filename must be an absolute path")
+            if op == 'probe':
+                djob = self.submit('probe', drive)
+            elif op == 'rpm':
+                djob = self.submit('rpm', drive)
+            elif op == 'verify':
+                options = {k: request[k] for k in VERIFY_OPTIONS if k in request}
+                djob = self.submit('verify_image', drive, request['format'], str(filename), **options)
+            else:
+                options = {k: request[k] for k in READ_OPTIONS if k in request}
+                if request.get('duplicates') == 'skip':
+                    options['duplicate_callback'] = lambda matches: True
+                djob = self.submit('read_image', drive, request['format'], str(filename), **options)
+            send({'ok': True, 'job': djob.job.id})
+            if request.get('watch', True):
+                self.watch(djob, send)
+        elif op == 'watch':
+            self.watch(self.get_job(request), send)
+        elif op == 'cancel':
+            djob = self.get_job(request)
+            djob.cancelled = True
+            djob.job.future.cancel()
+            send({'ok': True, 'job': djob.job.id})
+        else:
+            raise ValueError(f"Unknown op: {op}")
+
+
+    def get_job(self, request: dict) -> DaemonJob:
+        try:
+            with self.jobs_lock:
+                return self.jobs[int(request['job'])]
+        except (KeyError, ValueError):
+            raise ValueError(f"No such job: {request.get('job')}")
+
+
+    def watch(self, djob: DaemonJob, send):
+        "Stream the job's progress until it's done"
+        seen = max(0, djob.sent - len(djob.events))
+        while True:
+            with djob.changed:
+                while djob.sent == seen and not djob.done:
+                    djob.changed.wait()
+                # the messages that haven't been sent to this client yet
+                unsent = min(djob.sent - seen, len(djob.events))
+                new = list(djob.events)[len(djob.events) - unsent:]
+                seen = djob.sent
+                done = djob.done
+            for message in new:
+                send({'event': 'progress', 'job': djob.job.id, 'message': message})
+            if done:
+                send({'event': 'done', 'job': djob.job.id, 'ok': djob.error is None,
+                      'result': djob.result, 'error': djob.error})
+                return
+
+
+    def close(self):
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        for djob in jobs:
+            djob.cancelled = True
+        self.scheduler.shutdown(wait=True)
+        self.floppy.close()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon: Daemon = self.server.daemon
+        lock = threading.Lock()
+
+        def send(response: dict):
+            with lock:
+                self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+                self.wfile.flush()
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                daemon.handle(json.loads(line), send)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                logging.debug(f"Request failed: {e}")
+                try:
+                    send({'ok': False, 'error': str(e)})
+                except OSError:
+                    return
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(config: Path, path: Path) -> int:
+    # never take the socket away from a daemon that's still running
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except FileNotFoundError:
+        pass
+    except ConnectionRefusedError:
+        # left behind by a daemon that didn't shut down cleanly
+        path.unlink(missing_ok=True)
+    else:
+        logging.error(f"Another daemon is already listening on {path}")
+        return 1
+    finally:
+        probe.close()
+    floppy = FloppyReader(config)
+    daemon = Daemon(floppy)
+    # only this user can connect, from the moment the socket exists
+    umask = os.umask(0o077)
+    try:
+        server = Server(str(path), RequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon = daemon
+    signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=server.shutdown).start())
+    logging.info(f"Listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        daemon.close()
+    return 0
+
+
+class DaemonClient:
+    """Send requests to a running daemon"""
+    def __init__(self, path: Path=SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(path))
+        self.file = self.sock.makefile("rwb")
+
+
+    def request(self, op: str, **args):
+        """Send the request and yield the responses to it, ending with the
+        job's 'done' event for jobs that are watched"""
+        self.file.write(json.dumps({'op': op, **args}).encode() + b"\n")
+        self.file.flush()
+        watching = op == 'watch' or (op in ('probe', 'read', 'verify', 'rpm') and args.get('watch', True))
+        for line in self.file:
+            response = json.loads(line)
+            yield response
+            if not watching or response.get('event') == 'done' or response.get('ok') is False:
+                return
+
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share the floppy reader between programs")
+    parser.add_argument("--socket", default=SOCKET, type=Path, help="The daemon's socket")
+    parser.add_argument("--debug", default=False, action="store_true", help="Enable debug logging")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("serve", help="Run the daemon")
+    p.add_argument("--config", default=Path(sys.path[0], "FloppyDiskReader.conf"), type=Path, help="Configuration file")
+    commands.add_parser("status", help="Show the drives and jobs")
+    for name in ('probe', 'rpm'):
+        p = commands.add_parser(name, help=f"Queue a {name} of a drive")
+        p.add_argument("drive")
+        p.add_argument("--no-watch", default=False, action="store_true", help="Don't wait for it to finish")
+    p = commands.add_parser("read", help="Queue a read of a disk")
+    p.add_argument("drive")
+    p.add_argument("format")
+    p.add_argument("filename", type=Path)
+    p.add_argument("--deferred", default=False, action="store_true", help="Read the whole disk before retrying bad tracks")
+    p.add_argument("--sparse", default=False, action="store_true", help="Only read the tracks the filesystem is using")
+    p.add_argument("--no-watch", default=False, action="store_true", help="Don't wait for it to finish")
+    p = commands.add_parser("verify", help="Queue a check of a disk against its image")
+    p.add_argument("drive")
+    p.add_argument("format")
+    p.add_argument("filename", type=Path)
+    p.add_argument("--max-errors", default=0, type=int, help="Bad sectors to allow before giving up")
+    p.add_argument("--no-watch", default=False, action="store_true", help="Don't wait for it to finish")
+    for name in ('watch', 'cancel'):
+        p = commands.add_parser(name, help=f"{name.capitalize()} a job")
+        p.add_argument("job", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.command == 'serve':
+        return serve(args.config, args.socket)
+
+    request = {}
+    if args.command in ('probe', 'rpm', 'read', 'verify'):
+        request = {'drive': drive_name(args.drive), 'watch': not args.no_watch}
+    if args.command == 'read':
+        request.update(format=args.format, filename=str(args.filename.absolute()),
+                       pipelined=True, deferred=args.deferred, sparse=args.sparse)
+    if args.command == 'verify':
+        request.update(format=args.format, filename=str(args.filename.absolute()), max_errors=args.max_errors)
+    if args.command in ('watch', 'cancel'):
+        request = {'job': args.job}
+
+    client = DaemonClient(args.socket)
+    ok = True
+    try:
+        for response in client.request(args.command, **request):
+            if response.get('event') == 'progress':
+                message = response['message']
+                print(f"{100 * message.get('progress', 0):5.1f}% {message['message']}", file=sys.stderr)
+            else:
+                ok = response.get('ok', True)
+                print(json.dumps(response, indent=2))
+    finally:
+        client.close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
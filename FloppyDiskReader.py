@@ -1,11 +1,17 @@
 #!/bin/env python3
 import argparse
+import html
 import logging
 from pathlib import Path
 import signal
 import sys
+import threading
 
-from floppy import FloppyReader, codec
+from floppy import FloppyReader, codec, track_log_entry
+from checkpoint import checkpoint_file
+import diagnostics
+import fluxstream
+from telemetry import load_summary
 from PySide6.QtWidgets import *
 from PySide6.QtGui import *
 from PySide6.QtCore import *
@@ -41,7 +47,9 @@ def main():
             
         window = MainWindow()
         window.show()
-        return app.exec()
+        res = app.exec()
+        floppy.close()
+        return res
 
     except Exception as e:
         logging.exception(e)
@@ -105,6 +113,10 @@ class MainWindow(QWidget):
         glayout.addWidget(self.tracks, 0, 1)
         glayout.addWidget(QLabel("Heads:"), 0, 2)
         glayout.addWidget(self.heads, 0, 3)
+        self.deferred = QCheckBox("Retry bad tracks after reading the rest of the disk")
+        glayout.addWidget(self.deferred, 1, 0, 1, -1)
+        self.sparse = QCheckBox("Only read the tracks the filesystem is using (quick look)")
+        glayout.addWidget(self.sparse, 2, 0, 1, -1)
 
         gbox.setLayout(glayout)
         layout.addWidget(gbox, 2, 0, 1, -1)
@@ -113,7 +125,9 @@ class MainWindow(QWidget):
         def do_read():
             readwindow = ProcessWindow(self.pdisk.currentData(), 
                                         self.format.currentText(), self.format.currentData(),
-                                        self.tracks.value(), self.heads.value())
+                                        self.tracks.value(), self.heads.value(),
+                                        deferred=self.deferred.isChecked(),
+                                        sparse=self.sparse.isChecked())
             #readwindow.setParent(self)
             readwindow.show()
             readwindow.read()
@@ -139,13 +153,68 @@ class MainWindow(QWidget):
 
         rpm.pressed.connect(check_rpm)
         layout.addWidget(rpm, 3, 1)
+
+        diagnose = QPushButton("Diagnose")
+        def do_diagnose():
+            diagwindow = DiagnosticsWindow(self.pdisk.currentData())
+            diagwindow.show()
+            diagwindow.diagnose()
+            diagwindow.exec()
+        diagnose.pressed.connect(do_diagnose)
+        layout.addWidget(diagnose, 3, 2)
         
         quit = QPushButton("Quit")
         quit.pressed.connect(QCoreApplication.quit)
-        layout.addWidget(quit, 3, 2)
+        layout.addWidget(quit, 3, 3)
         self.setLayout(layout)
 
 
+class Worker(QObject):
+    """Run a floppy operation on its own thread so the hardware never waits
+    on the GUI.  Progress messages from the operation's callback are sent
+    to the GUI thread through the progress signal, and setting cancelled
+    stops the operation at its next callback.
+    """
+    progress = Signal(object)
+    finished = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, function, *args, **kwargs):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.worker_thread = QThread()
+        self.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.run)
+        self.finished.connect(self.worker_thread.quit)
+        self.failed.connect(self.worker_thread.quit)
+
+    def start(self):
+        self.worker_thread.start()
+
+    def stop(self):
+        "Cancel the operation and wait for it to wind down"
+        self.cancelled = True
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+
+    def callback(self, message):
+        self.progress.emit(message)
+        return self.cancelled
+
+    @Slot()
+    def run(self):
+        try:
+            res = self.function(*self.args, callback=self.callback, **self.kwargs)
+        except Exception as e:
+            logging.exception(e)
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(res)
+
+
 class ProbeWindow(QDialog):
     def __init__(self, drive: str):
         super().__init__()
@@ -154,6 +223,7 @@ class ProbeWindow(QDialog):
         self.drive = drive
         self.format_name = None
         self.result_value = None
+        self.worker: Worker = None
         layout = QGridLayout()
         
         self.format = QComboBox()
@@ -181,20 +251,22 @@ class ProbeWindow(QDialog):
     def probe(self):
         # turn off the buttons
         self.ok.setDisabled(True)
-        self.cancel_probe = False
-        def do_cancel_probe():
-            self.cancel_probe = True
-        self.cancel.pressed.connect(do_cancel_probe)
         self.format.setDisabled(True)
-        QGuiApplication.processEvents()
-        
-        def callback(x):
+
+        def progress(x):
             self.format.setItemText(0, f"{x['message']} ({100*x['progress']:0.2f}%)")
-            QGuiApplication.processEvents()
-            return self.cancel_probe
 
-        items = floppy.probe(self.drive, callback=callback)
-        if self.cancel_probe:
+        def failed(error):
+            self.format.setItemText(0, f"Error: {error}")
+
+        self.worker = Worker(floppy.probe, self.drive)
+        self.worker.progress.connect(progress)
+        self.worker.finished.connect(self.probed)
+        self.worker.failed.connect(failed)
+        self.worker.start()
+
+    def probed(self, items):
+        if self.worker.cancelled:
             return
         
         if not items:
@@ -211,9 +283,99 @@ class ProbeWindow(QDialog):
     def result(self):
         return self.result_value
 
+    def done(self, result):
+        # closing, escape, etc all end up here
+        if self.worker:
+            self.worker.stop()
+        super().done(result)
+
+
+class DiagnosticsWindow(QDialog):
+    "Check the drive's health and compare it with the last time"
+    FIGURES = (('rpm_mean', 'RPM', '0.2f'),
+               ('rpm_min', 'Min RPM', '0.2f'),
+               ('rpm_max', 'Max RPM', '0.2f'),
+               ('index_jitter_us', 'Index jitter (us)', '0.1f'),
+               ('wow_flutter_pct', 'Wow/flutter (%)', '0.3f'),
+               ('flux_spread_pct', 'Flux spread (% cell)', '0.2f'))
+
+    def __init__(self, drive: str):
+        super().__init__()
+        self.setWindowTitle(f"Drive {drive} Diagnostics")
+        self.setModal(True)
+        self.drive = drive
+        self.worker: Worker = None
+        # the last run, to see if the drive is drifting
+        previous = diagnostics.history(drive)
+        self.previous = previous[-1] if previous else None
+        layout = QGridLayout()
+
+        self.results = QTextEdit()
+        self.results.setReadOnly(True)
+        self.results.setMinimumSize(60 * 8, 20 * 12)
+        layout.addWidget(self.results, 0, 0, 1, -1)
+
+        self.progress = QProgressBar(minimum=0, maximum=100)
+        layout.addWidget(self.progress, 1, 0)
+
+        self.closebtn = QPushButton("Close")
+        self.closebtn.pressed.connect(self.close)
+        layout.addWidget(self.closebtn, 1, 1)
+        self.setLayout(layout)
+        self.adjustSize()
+
+    def diagnose(self):
+        self.results.setText("Insert a formatted disk.  Capturing...")
+
+        def progress(x):
+            self.progress.setValue(int(100 * x['progress']))
+            self.results.setText(x['message'])
+
+        def failed(error):
+            self.results.setText(f"Error: {error}")
+
+        self.worker = Worker(floppy.diagnose, self.drive)
+        self.worker.progress.connect(progress)
+        self.worker.finished.connect(self.diagnosed)
+        self.worker.failed.connect(failed)
+        self.worker.start()
+
+    def diagnosed(self, result):
+        if self.worker.cancelled or result is None:
+            return
+        cyls = list(result['cylinders'])
+        rows = [f"<tr><th></th>{''.join(f'<th>Cyl {c}</th>' for c in cyls)}<th>Drive</th>"
+                f"{'<th>Last run</th>' if self.previous else ''}</tr>"]
+        for key, label, fmt in self.FIGURES:
+            cells = [result['cylinders'][c].get(key) for c in cyls] + [result['summary'].get(key)]
+            if self.previous:
+                cells.append(self.previous.get('summary', {}).get(key))
+            rows.append(f"<tr><td>{label}</td>"
+                        + ''.join(f"<td align='right'>{'-' if v is None else format(v, fmt)}</td>" for v in cells)
+                        + "</tr>")
+        text = f"<p>Nominal {result['nominal_rpm']} RPM, {result['revs']} revolutions per cylinder</p>"
+        text += f"<table cellspacing='6'>{''.join(rows)}</table>"
+        if 'drift_pct' in result['summary']:
+            text += f"<p>Speed drift {result['summary']['drift_pct']:+0.2f}%"
+            if self.previous and 'drift_pct' in self.previous.get('summary', {}):
+                text += f" (was {self.previous['summary']['drift_pct']:+0.2f}% on {self.previous['time']})"
+            text += "</p>"
+        self.results.setHtml(text)
+
+    def done(self, result):
+        if self.worker:
+            self.worker.stop()
+        super().done(result)
+
 
 class ProcessWindow(QDialog):
-    def __init__(self, drive: str, format_name: str, format: codec.DiskDef, tracks: int, heads: int):
+    # asks about a probable duplicate from the worker thread, which waits
+    # for duplicate_answered.  It's queued rather than blocking so closing
+    # the window can answer it and the worker can wind down.
+    ask_duplicate = Signal(object)
+
+    def __init__(self, drive: str, format_name: str, format: codec.DiskDef, tracks: int, heads: int,
+                 deferred: bool=False, sparse: bool=False):
         super().__init__()
         self.setWindowTitle("Reading Disk")
         self.drive = drive
@@ -221,9 +383,22 @@ class ProcessWindow(QDialog):
         self.format = format
         self.tracks = tracks
         self.heads = heads
+        self.deferred = deferred
+        self.sparse = sparse
         self.image_file: Path = None
         self.log_file: Path = None
-        self.cancel_read = False
+        self.flux_file: Path = None
+        self.worker: Worker = None
+        self.log = None
+        self.has_errors = False
+        # log lines waiting to be shown, they're added in batches on a timer
+        # so a flood of retries can't bog down the window
+        self.pending_log: list[str] = []
+        self.log_timer = QTimer(self, interval=250)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.duplicate_of: str = None
+        self.duplicate_answered = threading.Event()
+        self.ask_duplicate.connect(self.confirm_duplicate, Qt.ConnectionType.QueuedConnection)
         logging.info(f"{drive}, {format_name}, {format}, {tracks}, {heads}")
 
         layout = QGridLayout()
@@ -245,10 +420,30 @@ class ProcessWindow(QDialog):
 
         self.closebtn = QPushButton("Cancel")
         def do_cancel_read():
-            self.cancel_read = True    
+            if self.worker:
+                self.worker.cancelled = True
         self.closebtn.pressed.connect(do_cancel_read)
         layout.addWidget(self.closebtn, 1, 3)
 
+        # filled in from the read's summary file when it's done
+        self.summary = QGroupBox("Summary")
+        slayout = QGridLayout()
+        self.summary_labels = {}
+        for i, (key, text) in enumerate((('tracks', "Tracks:"), ('bad_tracks', "Bad tracks:"),
+                                         ('retries', "Retries:"), ('tracks_per_s', "Tracks/s:"),
+                                         ('seek', "Seeking:"), ('capture', "Capturing:"),
+                                         ('decode', "Decoding:"), ('elapsed', "Elapsed:"))):
+            self.summary_labels[key] = QLabel()
+            slayout.addWidget(QLabel(text), i // 4, 2 * (i % 4))
+            slayout.addWidget(self.summary_labels[key], i // 4, 2 * (i % 4) + 1)
+        self.summary.setLayout(slayout)
+        self.summary.hide()
+        layout.addWidget(self.summary, 2, 0, 1, -1)
+
+        # this is offered in the save dialog, since the read starts as soon
+        # as the file has been picked.
+        self.save_flux = QCheckBox("Also save the raw flux")
+
         self.setLayout(layout)
         self.adjustSize()
 
@@ -265,44 +460,130 @@ class ProcessWindow(QDialog):
                            filter=f"Disk Image *{ext}(*{ext})",
                            acceptMode=QFileDialog.AcceptMode.AcceptSave,                           
                            )
+        fdlg.setOption(QFileDialog.Option.DontUseNativeDialog)
+        fdlg.layout().addWidget(self.save_flux)
         fdlg.fileSelected.connect(file_selected)
         fdlg.exec()        
+        save_flux = self.save_flux.isChecked()
         QGuiApplication.processEvents()
         if self.image_file:
             self.image_file = Path(self.image_file)
             self.log_file = self.image_file.parent / ((self.image_file.name) + ".log")            
             self.results.appendHtml(f"<pre>Writing Disk image to {self.image_file}</pre>")
             self.results.appendHtml(f"<pre>Writing Disk log to {self.log_file}</pre>")
-            self.has_errors = False
-            with open(self.log_file, "w") as f:
-                def do_log(message):
-                    msg = f"{message['logical_cylinder']}.{message['head']}: {message['message']}\n  {message['dat']}\n  {message['flux']}\n"
-                    self.results.appendHtml(f"<pre>{msg}</pre>")
-                    f.write(msg)
-                    cursor = self.results.textCursor()
-                    cursor.movePosition(QTextCursor.MoveOperation.End)
-                    cursor.movePosition(QTextCursor.MoveOperation.StartOfLine)
-                    self.results.setTextCursor(cursor)
-
-
-                def track_callback(message):
-                    self.progress.setValue(message['progress'] * 100)
-                    if not message['success']:
-                        self.has_errors = True
-                    do_log(message)
-                    QGuiApplication.processEvents()
-                    return self.cancel_read
-            
-                floppy.read_image(self.drive, self.format_name, self.image_file, 0, self.tracks, 0, self.heads, callback=track_callback)
-
-                if self.has_errors:
-                    self.results.appendHtml(f"<pre>The disk had read errors, review the log</pre>")
-                else:
-                    self.results.appendHtml(f"<pre>The disk was read successfully</pre>")
+            if save_flux:
+                self.flux_file = self.image_file.parent / ((self.image_file.name) + fluxstream.SUFFIX)
+                self.results.appendHtml(f"<pre>Writing raw flux to {self.flux_file}</pre>")
+            resume = False
+            if checkpoint_file(self.image_file).exists():
+                answer = QMessageBox.question(self, "Resume Read",
+                                              f"An unfinished read of {self.image_file.name} was found.\n"
+                                              "Resume it and only read the tracks that are missing or bad?")
+                resume = answer == QMessageBox.StandardButton.Yes
+                if resume:
+                    self.results.appendHtml(f"<pre>Resuming the earlier read</pre>")
+            self.log = open(self.log_file, "a" if resume else "w", buffering=1 << 16)
+            self.worker = Worker(floppy.read_image, self.drive, self.format_name, self.image_file,
+                                 0, self.tracks, 0, self.heads, pipelined=True, flux_file=self.flux_file,
+                                 resume=resume, deferred=self.deferred, sparse=self.sparse,
+                                 duplicate_callback=self.duplicate_found)
+            self.worker.progress.connect(self.track_read)
+            self.worker.finished.connect(self.read_done)
+            self.worker.failed.connect(self.read_failed)
+            self.log_timer.start()
+            self.worker.start()
+        else:
+            self.done_reading()
+
+    def track_read(self, message):
+        self.progress.setValue(message['progress'] * 100)
+        if not message['success'] and not message['retry']:
+            self.has_errors = True
+        msg = track_log_entry(message)
+        self.log.write(msg)
+        self.pending_log.append(msg)
+
+    def duplicate_found(self, matches) -> bool:
+        "Called on the worker thread, True to stop reading"
+        self.duplicate_answered.clear()
+        self.ask_duplicate.emit(matches)
+        self.duplicate_answered.wait()
+        return self.duplicate_of is not None
+
+    def confirm_duplicate(self, matches):
+        try:
+            if not self.worker or self.worker.cancelled:
+                return
+            original = matches[0]
+            answer = QMessageBox.question(self, "Probable Duplicate",
+                                          f"This disk looks like a copy of\n{original['image']}\n"
+                                          f"which was imaged on {original['created']}.\n\n"
+                                          "Stop reading and record it as a duplicate?")
+            if answer == QMessageBox.StandardButton.Yes:
+                self.duplicate_of = original['image']
+        finally:
+            self.duplicate_answered.set()
+
+    def flush_log(self):
+        if not self.pending_log:
+            return
+        self.results.appendHtml(f"<pre>{html.escape(''.join(self.pending_log))}</pre>")
+        self.pending_log.clear()
+        cursor = self.results.textCursor()
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.movePosition(QTextCursor.MoveOperation.StartOfLine)
+        self.results.setTextCursor(cursor)
+
+    def read_done(self, completed):
+        self.flush_log()
+        if self.duplicate_of:
+            self.results.appendHtml(f"<pre>Recorded as a duplicate of {html.escape(self.duplicate_of)}, no image was written</pre>")
+        elif not completed:
+            self.results.appendHtml(f"<pre>The read was cancelled</pre>")
+        elif self.has_errors:
+            self.results.appendHtml(f"<pre>The disk had read errors, review the log</pre>")
+        else:
+            self.results.appendHtml(f"<pre>The disk was read successfully</pre>")
+        self.done_reading()
 
+    def read_failed(self, error):
+        self.flush_log()
+        self.results.appendHtml(f"<pre>The read failed: {html.escape(error)}</pre>")
+        self.done_reading()
 
-            self.closebtn.setText("Close")
-            self.closebtn.pressed.connect(self.close)
+    def show_summary(self):
+        summary = load_summary(self.image_file) if self.image_file else None
+        if not summary:
+            return
+        values = {'tracks': f"{summary['tracks']} ({summary['restored']} restored)",
+                  'bad_tracks': str(summary['bad_tracks']),
+                  'retries': f"{summary['retries']} ({100 * summary['retry_ratio']:.0f}%)",
+                  'tracks_per_s': f"{summary['tracks_per_s']:.2f}",
+                  'elapsed': f"{summary['elapsed']:.1f}s"}
+        for phase, t in summary['phases'].items():
+            values[phase] = f"{t:.1f}s"
+        for key, label in self.summary_labels.items():
+            label.setText(values.get(key, ''))
+        self.summary.show()
+
+    def done_reading(self):
+        self.show_summary()
+        self.log_timer.stop()
+        if self.log:
+            self.log.close()
+            self.log = None
+        self.closebtn.setText("Close")
+        self.closebtn.pressed.connect(self.close)
+
+    def done(self, result):
+        # closing, escape, etc all end up here
+        if self.worker:
+            # a pending duplicate question is answered with "keep reading",
+            # and the cancel stops the read at its next callback
+            self.worker.cancelled = True
+            self.duplicate_answered.set()
+            self.worker.stop()
+        super().done(result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+#!/bin/env python3
+"""Continuous feed imaging
+
+Watches every configured drive for a disk to be put in, and then probes
+it, reads it with the most likely format into a file named from a
+template, and goes back to waiting for the disk to be swapped.  There's
+nothing to click or type between disks, so the operator only has to keep
+the drives loaded.
+
+Each drive is watched on its own thread.  Drives on different
+greaseweazles are read at the same time;  a drive that shares a
+greaseweazle with one that is being read is noticed when that read is
+done, so it can be loaded while the other one is busy.
+
+The template is a path with these fields:
+    {drive}     the drive the disk was read in
+    {format}    the format it was read as
+    {n}         a number that makes the name unique
+    {date}      today's date, YYYY-MM-DD
+    {time}      the time the read started, HHMMSS
+The format's extension is added when the template doesn't have one.
+"""
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import sys
+import threading
+
+from checkpoint import checkpoint_file
+from floppy import FloppyReader, best_format, drive_name
+from FloppyBatch import BatchRunner
+
+
+DEFAULT_TEMPLATE = "{date}/disk-{n:04d}"
+
+
+class Namer:
+    """Make the image filenames from the template, shared by all of the drives"""
+    def __init__(self, template: str, floppy: FloppyReader):
+        self.template = template
+        self.floppy = floppy
+        self.n = 1
+        self.lock = threading.Lock()
+
+
+    def next(self, drive: str, format: str) -> Path:
+        with self.lock:
+            now = datetime.now()
+            while True:
+                output = Path(self.template.format(drive=drive.replace(':', '-'), format=format, n=self.n,
+                                                   date=now.strftime('%Y-%m-%d'), time=now.strftime('%H%M%S')))
+                if not output.suffix:
+                    output = output.with_name(output.name + self.floppy.get_extension_for_format(format))
+                output = output.absolute()
+                self.n += 1
+                # never pick up another disk's image or its checkpoint
+                if not output.exists() and not checkpoint_file(output).exists():
+                    break
+            output.parent.mkdir(parents=True, exist_ok=True)
+            # hold the name until the read creates the image
+            output.touch()
+            return output
+
+
+class DriveFeeder(threading.Thread):
+    """Wait for a disk in one drive, image it, and wait for the next one"""
+    def __init__(self, runner: BatchRunner, drive: str, namer: Namer, stop: threading.Event,
+                 poll: float=1, settle: float=1):
+        super().__init__(name=f"feed-{drive}", daemon=True)
+        self.runner = runner
+        self.floppy = runner.floppy
+        self.drive = drive
+        self.namer = namer
+        self.stop = stop
+        self.poll = poll
+        self.settle = settle
+        self.disks = 0
+
+
+    def run(self):
+        # the disk in the drive has been dealt with, wait for it to be swapped
+        handled = False
+        print(f"Drive {self.drive}: waiting for a disk")
+        while not self.stop.is_set():
+            try:
+                present, changed = self.floppy.disk_state(self.drive)
+            except Exception as e:
+                logging.warning(f"Cannot check drive {self.drive}: {e}")
+                self.stop.wait(self.poll)
+                continue
+            if changed or not present:
+                handled = False
+            if present and not handled:
+                # give the operator time to finish putting it in
+                if self.stop.wait(self.settle):
+                    break
+                handled = True
+                self.image()
+                print(f"Drive {self.drive}: waiting for the next disk")
+            self.stop.wait(self.poll)
+
+
+    def image(self):
+        """Probe the disk and read it with the best format"""
+        output: Path = None
+        try:
+            probed = self.floppy.probe(self.drive)
+            if not probed:
+                print(f"Drive {self.drive}: no format could be found, swap the disk")
+                return
+            format = best_format(probed)
+            logging.info(f"Probed {self.drive} as {format}: {probed[format]}")
+            output = self.namer.next(self.drive, format)
+            status, message, values = self.runner.image({'drive': self.drive, 'format': format,
+                                                         'output': str(output), 'label': None,
+                                                         'track_min': None, 'track_max': None,
+                                                         'head_min': None, 'head_max': None})
+        except Exception as e:
+            logging.exception(e)
+            print(f"Drive {self.drive}: failed, {e}")
+            return
+        finally:
+            # don't leave the placeholder behind when nothing was written
+            if output and output.exists() and not output.stat().st_size:
+                output.unlink()
+        self.disks += 1
+        print(f"Drive {self.drive}: {output.name}: {status}, {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image floppy disks as they're put in the drives")
+    parser.add_argument("--config", default=Path(sys.path[0], "FloppyDiskReader.conf"), type=Path, help="Configuration file")
+    parser.add_argument("--debug", default=False, action="store_true", help="Enable debug logging")
+    parser.add_argument("--drive", action="append", help="Only watch this drive (can be repeated)")
+    parser.add_argument("--poll", default=1, type=float, help="Seconds between checks for a disk")
+    parser.add_argument("--settle", default=1, type=float, help="Seconds to wait after a disk is put in")
+    parser.add_argument("--deferred", default=False, action="store_true", help="Read the whole disk before retrying bad tracks")
+    parser.add_argument("--sparse", default=False, action="store_true", help="Only read the tracks the filesystem is using")
+    parser.add_argument("--time-budget", type=float, help="Stop retrying bad tracks after this many seconds per disk")
+    parser.add_argument("--duplicates", choices=('skip', 'read'), default='read',
+                        help="What to do with disks that have already been imaged")
+    parser.add_argument("template", nargs='?', default=DEFAULT_TEMPLATE,
+                        help=f"Where to put the images (default: {DEFAULT_TEMPLATE})")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    floppy = FloppyReader(args.config)
+    drives = [drive_name(d) for d in args.drive] if args.drive else list(floppy.drives)
+    for d in drives:
+        if d not in floppy.drives:
+            parser.error(f"Drive {d} is not configured")
+    runner = BatchRunner(floppy, None, prompt=False, deferred=args.deferred, sparse=args.sparse,
+                         time_budget=args.time_budget, duplicates=args.duplicates)
+    namer = Namer(args.template, floppy)
+    stop = threading.Event()
+    feeders = [DriveFeeder(runner, d, namer, stop, args.poll, args.settle) for d in drives]
+    for f in feeders:
+        f.start()
+    try:
+        try:
+            while any(f.is_alive() for f in feeders):
+                for f in feeders:
+                    f.join(0.5)
+        except KeyboardInterrupt:
+            print("\nFinishing the disks being read, ^C again to abandon them")
+            stop.set()
+            for f in feeders:
+                f.join()
+    except KeyboardInterrupt:
+        print("\nAbandoned, the interrupted disks have checkpoints")
+        return 1
+    finally:
+        print(f"{sum(f.disks for f in feeders)} disks imaged")
+        floppy.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/bin/env python3
+"""Decode throughput benchmark
+
+Runs the disk images in sample_floppies through the same path read_image
+uses, without the hardware:  the flux for every track comes from a
+simulated greaseweazle with the drive delays turned off, and it's decoded
+with the format's DiskDef, emitted into an image and the image is built.
+Each stage is timed separately, then the whole thing is run again under
+tracemalloc to get the peak memory used and the memory blocks that are
+still held once it's done.
+
+That block count stands in for the allocation count that was asked for.
+It's a net figure, blocks allocated less blocks freed, so a decoder that
+churns through short-lived objects scores the same as one that doesn't.
+tracemalloc only tracks live blocks and CPython keeps no running total of
+allocations outside a --enable-pystats build, so counting every one would
+mean hooking the allocator from C, which is more than a benchmark should
+carry.  The peak memory shows most of the same regressions.
+
+The results can be saved as a JSON baseline and later runs compared
+against it, so a change that slows down the read pipeline for any format
+shows up straight away.
+"""
+import argparse
+import json
+import logging
+import math
+from pathlib import Path
+import platform
+import sys
+import time
+import tracemalloc
+from greaseweazle.tools import util
+
+from registry import registry
+import simulator
+
+
+SAMPLES = Path(sys.path[0], "sample_floppies")
+
+
+def capture_all(path: Path, format: str, revs: int) -> dict[tuple[int, int], object]:
+    """Capture every track of the image from a simulated greaseweazle"""
+    fmt = registry.get_diskdef(format)
+    gw = simulator.SimulatedUnit(path, format, realtime=False)
+    fluxes = {}
+    for cyl in range(fmt.cyls):
+        for head in range(fmt.heads):
+            gw.seek(cyl, head)
+            fluxes[(cyl, head)] = gw.read_track(revs)
+    return fluxes
+
+
+def run_pipeline(path: Path, format: str, fluxes: dict) -> dict[str, float]:
+    """Decode, emit and build the image, returning the seconds for each"""
+    fmt = registry.get_diskdef(format)
+    image_class = util.get_image_class(str(path))
+    img = image_class.to_file(str(path.with_name("benchmark" + path.suffix)), fmt, False, {})
+    times = dict.fromkeys(('decode', 'emit', 'get_image'), 0.0)
+    missing = 0
+    for (cyl, head), flux in fluxes.items():
+        started = time.perf_counter()
+        dat = fmt.decode_flux(cyl, head, flux)
+        decoded = time.perf_counter()
+        img.emit_track(cyl, head, dat)
+        times['decode'] += decoded - started
+        times['emit'] += time.perf_counter() - decoded
+        missing += dat.nr_missing()
+    started = time.perf_counter()
+    img.get_image()
+    times['get_image'] = time.perf_counter() - started
+    if missing:
+        logging.warning(f"{path.name}: {missing} sectors didn't decode")
+    return times
+
+
+def benchmark(path: Path, repeat: int=3) -> dict:
+    format = simulator.format_for_image(path)
+    fmt = registry.get_diskdef(format)
+    # the same revolutions read_image captures
+    revs = max(2, math.ceil(fmt.default_revs))
+    fluxes = capture_all(path, format, revs)
+
+    # best of the runs, the others are just noise from the rest of the machine
+    runs = [run_pipeline(path, format, fluxes) for _ in range(repeat)]
+    best = min(runs, key=lambda x: sum(x.values()))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run_pipeline(path, format, fluxes)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+
+    tracks = len(fluxes)
+    return {'format': format,
+            'tracks': tracks,
+            'revs': revs,
+            'decode_s': round(best['decode'], 4),
+            'emit_s': round(best['emit'], 4),
+            'get_image_s': round(best['get_image'], 4),
+            'tracks_per_s': round(tracks / (best['decode'] + best['emit']), 2),
+            'peak_bytes': peak,
+            'retained_blocks': retained}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """The images that got slower than the baseline by more than tolerance"""
+    slower = []
+    for name, res in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        change = base['tracks_per_s'] / res['tracks_per_s'] - 1
+        memory = res['peak_bytes'] / base['peak_bytes'] - 1 if base['peak_bytes'] else 0
+        print(f"{name:24s} {100 * -change:+6.1f}% tracks/s  {100 * memory:+6.1f}% peak memory")
+        if change > tolerance:
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark decoding the sample floppy images")
+    parser.add_argument("--samples", default=SAMPLES, type=Path, help="Directory of disk images")
+    parser.add_argument("--format", action="append", help="Only benchmark this format (can be repeated)")
+    parser.add_argument("--repeat", default=3, type=int, help="Timed runs for each image, the best is kept")
+    parser.add_argument("--save", type=Path, help="Save the results as a baseline")
+    parser.add_argument("--baseline", type=Path, help="Compare the results with a saved baseline")
+    parser.add_argument("--tolerance", default=0.1, type=float, help="How much slower than the baseline is a regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {}
+    print(f"{'image':24s} {'format':18s} {'tracks/s':>9s} {'decode':>8s} {'emit':>8s} {'image':>8s} {'peak KB':>9s} {'retained':>8s}")
+    for path in sorted(args.samples.iterdir()):
+        if path.suffix.lower() not in util.image_types or path.name.startswith('benchmark'):
+            continue
+        if args.format and simulator.format_for_image(path) not in args.format:
+            continue
+        res = benchmark(path, args.repeat)
+        results[path.name] = res
+        print(f"{path.name:24s} {res['format']:18s} {res['tracks_per_s']:9.1f} {res['decode_s']:8.3f} "
+              f"{res['emit_s']:8.3f} {res['get_image_s']:8.3f} {res['peak_bytes'] // 1024:9d} {res['retained_blocks']:8d}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'greaseweazle': registry.version,
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        if slower:
+            print(f"Slower than the baseline: {', '.join(slower)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/bin/env python3
+"""Catalog of the files on the imaged disks
+
+The tracks read_image decodes are kept as they finish, and once the disk
+is done its filesystem is walked in memory and every file's name, size,
+date and SHA-256 is stored in a SQLite catalog, so finding which disk a
+file was on is a single indexed query instead of opening every image.
+
+The filesystems are read by the parsers in filesystems.py.
+
+Existing images can be added to the catalog, and it can be searched, from
+the command line:
+
+    catalog.py add images/*.img
+    catalog.py search 'README*'
+    catalog.py hash <sha256>
+"""
+import argparse
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import sys
+import threading
+from greaseweazle.codec import codec
+
+from filesystems import Tracks, list_files
+from registry import registry
+import simulator
+
+
+CATALOG_FILE = Path(os.environ.get('XDG_DATA_HOME', Path.home() / '.local' / 'share'), 'FloppyDiskReader', 'catalog.db')
+
+SCHEMA = """
+create table if not exists images (
+    id integer primary key,
+    image text not null unique,
+    format text not null,
+    filesystem text not null,
+    volume text,
+    files integer not null,
+    cataloged text not null
+);
+create table if not exists files (
+    id integer primary key,
+    image_id integer not null references images(id),
+    path text not null,
+    name text not null collate nocase,
+    size integer not null,
+    resource_size integer,
+    modified text,
+    kind text,
+    sha256 text
+);
+create index if not exists files_name on files (name);
+create index if not exists files_sha256 on files (sha256);
+create index if not exists files_image on files (image_id);
+"""
+
+
+class Catalog:
+    """The catalog of the files on every imaged disk.  It can be used from
+    any thread."""
+    def __init__(self, filename: Path=CATALOG_FILE):
+        self.filename = Path(filename)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            self.db.executescript(SCHEMA)
+
+
+    def add(self, image, format: str, fmt: codec.DiskDef, tracks: Tracks) -> int | None:
+        """Catalog the files on the disk, replacing what was there for the
+        image before.  Returns the number of files, or None if the
+        filesystem couldn't be read."""
+        listing = list_files(format, fmt, tracks)
+        if listing is None:
+            return None
+        filesystem, volume, files = listing
+        image = str(Path(image).absolute())
+        rows = [(f.path, f.path.rsplit('/', 1)[-1], f.size, f.resource_size,
+                 f.modified.isoformat(timespec='seconds') if f.modified else None, f.kind, f.sha256)
+                for f in files]
+        # the whole disk goes in as one transaction
+        with self._lock, self.db:
+            old = self.db.execute("select id from images where image=?", (image,)).fetchone()
+            if old:
+                self.db.execute("delete from files where image_id=?", (old['id'],))
+                self.db.execute("delete from images where id=?", (old['id'],))
+            image_id = self.db.execute("""insert into images (image, format, filesystem, volume, files, cataloged)
+                                          values (?, ?, ?, ?, ?, ?)""",
+                                       (image, format, filesystem, volume, len(files),
+                                        datetime.now().isoformat(timespec='seconds'))).lastrowid
+            self.db.executemany("""insert into files (image_id, path, name, size, resource_size, modified, kind, sha256)
+                                   values (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                [(image_id, *row) for row in rows])
+        return len(files)
+
+
+    def search(self, pattern: str, limit: int=1000) -> list[sqlite3.Row]:
+        """The files with a name matching the pattern, where * and ? are
+        wildcards.  Names that don't start with a wildcard use the index."""
+        query = """select images.image, images.format, images.volume, files.path, files.size,
+                          files.modified, files.kind, files.sha256
+                   from files join images on images.id = files.image_id"""
+        if '*' in pattern or '?' in pattern:
+            like = (pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                    .replace('*', '%').replace('?', '_'))
+            query += " where files.name like ? escape '\\'"
+            args = (like, limit)
+        else:
+            query += " where files.name = ?"
+            args = (pattern, limit)
+        with self._lock:
+            return self.db.execute(query + " order by images.image, files.path limit ?", args).fetchall()
+
+
+    def find_hash(self, digest: str) -> list[sqlite3.Row]:
+        """Every copy of a file, by its SHA-256"""
+        with self._lock:
+            return self.db.execute("""select images.image, images.format, images.volume, files.path, files.size,
+                                             files.modified, files.kind, files.sha256
+                                      from files join images on images.id = files.image_id
+                                      where files.sha256 = ? order by images.image""", (digest.lower(),)).fetchall()
+
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+def image_tracks(filename: Path, fmt: codec.DiskDef) -> Tracks:
+    """The decoded tracks of an existing image"""
+    img = simulator.open_image(filename, fmt)
+    tracks = {}
+    for c in range(fmt.cyls):
+        for h in range(fmt.heads):
+            trk = img.get_track(c, h)
+            if trk is not None:
+                tracks[(c, h)] = bytes(trk.get_img_track())
+    return tracks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog the files on disk images and search them")
+    parser.add_argument("--catalog", default=CATALOG_FILE, type=Path, help="The catalog database")
+    parser.add_argument("--debug", default=False, action="store_true", help="Enable debug logging")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("add", help="Catalog existing images")
+    p.add_argument("--format", help="The format of the images (default: guess from the image)")
+    p.add_argument("images", nargs='+', type=Path)
+    p = commands.add_parser("search", help="Find files by name, * and ? are wildcards")
+    p.add_argument("pattern")
+    p.add_argument("--limit", default=1000, type=int)
+    p = commands.add_parser("hash", help="Find the copies of a file by its SHA-256")
+    p.add_argument("digest")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    catalog = Catalog(args.catalog)
+    try:
+        if args.command == 'add':
+            for path in args.images:
+                try:
+                    format = args.format or simulator.format_for_image(path)
+                    fmt = registry.get_diskdef(format)
+                    count = catalog.add(path, format, fmt, image_tracks(path, fmt))
+                except Exception as e:
+                    print(f"{path}: {e}")
+                    continue
+                print(f"{path}: {'no filesystem found' if count is None else f'{count} files'}")
+            return 0
+        rows = catalog.search(args.pattern, args.limit) if args.command == 'search' else catalog.find_hash(args.digest)
+        for row in rows:
+            print(f"{row['image']}: {row['path']}  {row['size']} bytes  {row['modified'] or ''}  {row['kind'] or ''}")
+        return 0 if rows else 1
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
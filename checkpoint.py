@@ -0,0 +1,102 @@
+#!/bin/env python3
+"""Checkpoints for resuming interrupted reads
+
+While read_image runs, each track is added to a checkpoint file next to
+the image as soon as it's finished, along with whether all of its sectors
+were read.  If the read is cancelled or dies, the checkpoint is left
+behind and a resumed read only has to capture the tracks that are missing
+or bad.  The checkpoint is removed once the image has been written.
+
+The file is a header (magic and a JSON line with the format) followed by
+one RECORD per track and the track's image data.  A later record for the
+same track replaces an earlier one.
+"""
+import json
+import logging
+from pathlib import Path
+import struct
+from greaseweazle.codec import codec
+
+
+MAGIC = b'FDRCKPT\x01'
+# cyl, head, complete, length of the track data
+RECORD = struct.Struct('<HBBI')
+SUFFIX = '.ckpt'
+
+
+def checkpoint_file(filename) -> Path:
+    filename = Path(filename)
+    return filename.parent / (filename.name + SUFFIX)
+
+
+class Checkpoint:
+    """A checkpoint for one image.  Opening it starts a new checkpoint,
+    keeping any tracks passed in from an earlier one.
+    """
+    def __init__(self, filename, format: str, tracks: dict=None):
+        self.filename = Path(filename)
+        self.format = format
+        self.file = open(self.filename, "wb")
+        self.file.write(MAGIC)
+        self.file.write(json.dumps({'format': format}).encode() + b'\n')
+        for (cyl, head), (complete, data) in (tracks or {}).items():
+            self._write(cyl, head, complete, data)
+        self.file.flush()
+
+
+    def _write(self, cyl: int, head: int, complete: bool, data: bytes):
+        self.file.write(RECORD.pack(cyl, head, complete, len(data)))
+        self.file.write(data)
+
+
+    def add(self, cyl: int, head: int, dat: codec.Codec):
+        """Save a finished track"""
+        self._write(cyl, head, dat.nr_missing() == 0, bytes(dat.get_img_track()))
+        self.file.flush()
+
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+    def remove(self):
+        self.close()
+        self.filename.unlink(missing_ok=True)
+
+
+    @staticmethod
+    def load(filename, format: str) -> dict[tuple[int, int], tuple[bool, bytes]]:
+        """Get the tracks from an existing checkpoint as a dictionary of
+        (cyl, head) -> (complete, track data).  A missing checkpoint, or one
+        made for a different format, has no tracks.
+        """
+        tracks = {}
+        try:
+            with open(filename, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    logging.warning(f"{filename} is not a checkpoint, ignoring it")
+                    return tracks
+                header = json.loads(f.readline())
+                if header.get('format') != format:
+                    logging.warning(f"Checkpoint {filename} is for {header.get('format')}, not {format}, ignoring it")
+                    return tracks
+                while len(hdr := f.read(RECORD.size)) == RECORD.size:
+                    cyl, head, complete, length = RECORD.unpack(hdr)
+                    data = f.read(length)
+                    if len(data) < length:
+                        # cut off in the middle of the last track
+                        break
+                    tracks[(cyl, head)] = (bool(complete), data)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logging.warning(f"Cannot read checkpoint {filename}: {e}")
+        return tracks
+
+
+def restore_track(fmt: codec.DiskDef, cyl: int, head: int, data: bytes) -> codec.Codec:
+    """Rebuild a decoded track from its checkpointed image data"""
+    dat = fmt.mk_track(cyl, head)
+    dat.set_img_track(data)
+    return dat
@@ -0,0 +1,117 @@
+#!/bin/env python3
+"""Drive health diagnostics
+
+A single RPM figure doesn't say much about a drive.  The diagnostics
+capture many revolutions on a few cylinders across the disk and work out,
+for each of them:
+
+    rpm_mean, rpm_min, rpm_max   the rotation speed over the revolutions
+    index_jitter_us              how much the revolution time varies
+    wow_flutter_pct              how much the bit cell varies around a
+                                 revolution (the speed within a turn)
+    flux_spread_pct              how far the transitions land from where
+                                 they should be, as a percentage of a cell
+
+Each run is added to a history file so a drive that is slowly drifting
+out of spec can be spotted before it starts causing retries.
+"""
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import numpy as np
+from greaseweazle.flux import Flux
+
+import fluxstats
+
+
+HISTORY_FILE = Path(os.environ.get('XDG_DATA_HOME', Path.home() / '.local' / 'share'), 'FloppyDiskReader', 'drive_health.jsonl')
+# segments each revolution is split into for wow and flutter
+SEGMENTS = 32
+
+
+def analyze(flux: Flux) -> dict:
+    """The health figures for one capture of several revolutions"""
+    revs = np.asarray(flux.index_list, dtype=np.float64) / flux.sample_freq
+    res = {'revs': len(revs)}
+    if not len(revs):
+        return res
+    rpm = 60 / revs
+    res.update(rpm_mean=round(float(rpm.mean()), 3),
+               rpm_min=round(float(rpm.min()), 3),
+               rpm_max=round(float(rpm.max()), 3),
+               index_jitter_us=round(float(revs.std() * 1e6), 2))
+
+    intervals = np.asarray(flux.list, dtype=np.float64) / flux.sample_freq
+    times = np.cumsum(intervals)
+    # only the transitions inside the whole revolutions
+    inside = times < revs.sum()
+    intervals, times = intervals[inside], times[inside]
+    if len(intervals) < fluxstats.MIN_INTERVALS:
+        return res
+    encoding, cell = fluxstats.guess_encoding(fluxstats.histogram_peaks(intervals))
+    if not encoding:
+        # unformatted or unrecognizable, so there's nothing to measure against
+        return res
+    cells = np.rint(intervals / cell)
+    valid = (cells > 0) & (cells <= 8)
+    intervals, times, cells = intervals[valid], times[valid], cells[valid]
+    res['encoding'] = encoding
+    res['cell_us'] = round(float(cell * 1e6), 4)
+    res['flux_spread_pct'] = round(float(100 * np.std(intervals / cell - cells)), 2)
+
+    # the average cell length in each part of each revolution
+    index_times = np.cumsum(revs)
+    rev = np.searchsorted(index_times, times, side='right')
+    start = np.concatenate(([0.0], index_times))[rev]
+    segment = np.minimum(((times - start) / revs[rev] * SEGMENTS).astype(int), SEGMENTS - 1)
+    bins = rev * SEGMENTS + segment
+    counts = np.bincount(bins, minlength=len(revs) * SEGMENTS)
+    totals = np.bincount(bins, weights=intervals / cells, minlength=len(revs) * SEGMENTS)
+    used = counts > 0
+    speed = totals[used] / counts[used]
+    res['wow_flutter_pct'] = round(float(100 * speed.std() / speed.mean()), 3)
+    res['wow_flutter_peak_pct'] = round(float(100 * (speed.max() - speed.min()) / speed.mean()), 3)
+    return res
+
+
+def summarize(cylinders: dict[int, dict], nominal_rpm: float=None) -> dict:
+    """Combine the per cylinder results into the figures for the drive"""
+    measured = [r for r in cylinders.values() if 'rpm_mean' in r]
+    summary = {}
+    if measured:
+        summary['rpm_mean'] = round(float(np.mean([r['rpm_mean'] for r in measured])), 3)
+        summary['rpm_min'] = min(r['rpm_min'] for r in measured)
+        summary['rpm_max'] = max(r['rpm_max'] for r in measured)
+        summary['index_jitter_us'] = max(r['index_jitter_us'] for r in measured)
+        if nominal_rpm:
+            summary['drift_pct'] = round(100 * (summary['rpm_mean'] / nominal_rpm - 1), 3)
+    for key in ('wow_flutter_pct', 'flux_spread_pct'):
+        values = [r[key] for r in cylinders.values() if key in r]
+        if values:
+            summary[key] = max(values)
+    return summary
+
+
+def save(drive: str, result: dict, filename: Path=HISTORY_FILE):
+    """Add a diagnostics run to the drive's history"""
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, "a") as f:
+        f.write(json.dumps({'drive': drive, 'time': datetime.now().isoformat(timespec='seconds'), **result}) + "\n")
+
+
+def history(drive: str, filename: Path=HISTORY_FILE) -> list[dict]:
+    """The earlier diagnostics runs for the drive, oldest first"""
+    runs = []
+    try:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    continue
+                if run.get('drive') == drive:
+                    runs.append(run)
+    except FileNotFoundError:
+        pass
+    return runs
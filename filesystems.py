@@ -0,0 +1,392 @@
+#!/bin/env python3
+"""The files on a disk, read from its filesystem in memory
+
+Each parser takes the format's DiskDef (only its geometry is used) and the
+decoded track data as a dictionary of (cyl, head) -> bytes, and returns
+the volume name and the files.  They only work on those bytes, so nothing
+here needs the greaseweazle.
+
+The filesystems understood are FAT12 (ibm.*), HFS and MFS (mac.* and HFS
+formatted ibm.* disks), AmigaDOS OFS and FFS (amiga.*) and Commodore DOS
+(commodore.1541, commodore.1571).
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import struct
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from greaseweazle.codec import codec
+
+
+Tracks = dict[tuple[int, int], bytes]
+
+
+@dataclass
+class File:
+    path: str
+    size: int
+    modified: datetime | None = None
+    sha256: str | None = None
+    # the file type: PRG, SEQ...  for Commodore, the type/creator on a Mac
+    kind: str | None = None
+    resource_size: int | None = None
+
+
+class Uncataloged(Exception):
+    "The disk doesn't have a filesystem that can be cataloged"
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def linear(fmt: codec.DiskDef, tracks: Tracks) -> bytes:
+    """The disk as a block device:  the tracks in cylinder then head order"""
+    try:
+        return b''.join(tracks[(c, h)] for c in range(fmt.cyls) for h in range(fmt.heads))
+    except KeyError as e:
+        raise Uncataloged(f"track {e.args[0][0]}.{e.args[0][1]} wasn't read")
+
+
+def fat12(fmt: codec.DiskDef, tracks: Tracks) -> tuple[str, list[File]]:
+    "The root directory and its subdirectories, long file names included"
+    data = linear(fmt, tracks)
+    (bps, spc, reserved, nfats, root_entries, total,
+     media, spf, spt, heads) = struct.unpack_from('<HBHBHHBHHH', data, 11)
+    if (bps not in (128, 256, 512, 1024) or spc not in (1, 2, 4, 8, 16, 32, 64)
+            or nfats not in (1, 2) or not spf or not total or total * bps > len(data)):
+        raise Uncataloged("no valid BPB in the boot sector")
+    root_start = reserved + nfats * spf
+    data_start = root_start + -(-root_entries * 32 // bps)
+    clusters = (total - data_start) // spc
+    if clusters >= 4085:
+        raise Uncataloged("not FAT12")
+    fat = data[reserved * bps:(reserved + spf) * bps]
+
+    def chain(first: int) -> bytes:
+        out = []
+        n = first
+        while 2 <= n < clusters + 2 and len(out) <= clusters:
+            offset = (data_start + (n - 2) * spc) * bps
+            out.append(data[offset:offset + spc * bps])
+            entry = struct.unpack_from('<H', fat, n * 3 // 2)[0]
+            n = entry >> 4 if n & 1 else entry & 0xfff
+        return b''.join(out)
+
+    def timestamp(time: int, date: int) -> datetime | None:
+        try:
+            return datetime(1980 + (date >> 9), (date >> 5) & 15, date & 31,
+                            time >> 11, (time >> 5) & 63, (time & 31) * 2)
+        except ValueError:
+            return None
+
+    volume = None
+    files = []
+    seen = set()
+
+    def walk(raw: bytes, path: str):
+        nonlocal volume
+        lfn = []
+        for i in range(0, len(raw) - 31, 32):
+            e = raw[i:i + 32]
+            if e[0] == 0:
+                break
+            attr = e[11]
+            if e[0] == 0xe5:
+                lfn = []
+                continue
+            if attr == 0x0f:
+                # long file name pieces come before the short entry, last piece first
+                part = e[1:11] + e[14:26] + e[28:32]
+                lfn.insert(0, part.decode('utf-16-le', 'replace').split('\0')[0].rstrip('\uffff'))
+                continue
+            short = e[:8].rstrip(b' ')
+            if short[:1] == b'\x05':
+                short = b'\xe5' + short[1:]
+            ext = e[8:11].rstrip(b' ')
+            name = ''.join(lfn) or (short + (b'.' + ext if ext else b'')).decode('cp437', 'replace')
+            lfn = []
+            if attr & 0x08:
+                if not path:
+                    volume = (e[:11].rstrip(b' ')).decode('cp437', 'replace')
+                continue
+            if name in ('.', '..'):
+                continue
+            time, date, first, size = struct.unpack_from('<HH H I', e, 22)
+            if attr & 0x10:
+                if first not in seen:
+                    seen.add(first)
+                    walk(chain(first), f"{path}{name}/")
+            else:
+                content = chain(first)[:size] if size else b''
+                files.append(File(path + name, size, timestamp(time, date), sha256(content)))
+
+    walk(data[root_start * bps:root_start * bps + root_entries * 32], '')
+    return volume, files
+
+
+AMIGA_EPOCH = datetime(1978, 1, 1)
+
+
+def amigados(fmt: codec.DiskDef, tracks: Tracks) -> tuple[str, list[File]]:
+    "The directory tree from the root block, OFS or FFS"
+    data = linear(fmt, tracks)
+    blocks = len(data) // 512
+    if data[:3] != b'DOS':
+        raise Uncataloged("no DOS boot block")
+    ffs = data[3] & 1
+
+    def block(n: int) -> bytes:
+        if not 2 <= n < blocks:
+            raise Uncataloged(f"block {n} is outside of the disk")
+        return data[n * 512:(n + 1) * 512]
+
+    def name(b: bytes) -> str:
+        return b[433:433 + min(b[432], 30)].decode('latin-1')
+
+    def timestamp(b: bytes, offset: int) -> datetime | None:
+        days, mins, ticks = struct.unpack_from('>3I', b, offset)
+        try:
+            return AMIGA_EPOCH + timedelta(days=days, minutes=mins, seconds=ticks / 50)
+        except OverflowError:
+            return None
+
+    def content(header: bytes, size: int) -> bytes:
+        out = []
+        b = header
+        for _ in range(blocks):
+            count = struct.unpack_from('>I', b, 8)[0]
+            table = struct.unpack_from('>72I', b, 24)
+            # the data blocks are listed from the end of the table backwards
+            for i in range(min(count, 72)):
+                d = block(table[71 - i])
+                if ffs:
+                    out.append(d)
+                else:
+                    out.append(d[24:24 + min(struct.unpack_from('>I', d, 12)[0], 488)])
+            extension = struct.unpack_from('>I', b, 504)[0]
+            if not extension:
+                break
+            b = block(extension)
+        return b''.join(out)[:size]
+
+    root = block(blocks // 2)
+    if struct.unpack_from('>I', root, 0)[0] != 2 or struct.unpack_from('>i', root, 508)[0] != 1:
+        raise Uncataloged("no root block")
+    files = []
+    seen = set()
+
+    def walk(directory: bytes, path: str):
+        for head in struct.unpack_from('>72I', directory, 24):
+            n = head
+            while n and n not in seen:
+                seen.add(n)
+                b = block(n)
+                if struct.unpack_from('>I', b, 0)[0] != 2:
+                    break
+                kind = struct.unpack_from('>i', b, 508)[0]
+                if kind == 2:
+                    walk(b, f"{path}{name(b)}/")
+                elif kind == -3:
+                    size = struct.unpack_from('>I', b, 324)[0]
+                    files.append(File(path + name(b), size, timestamp(b, 420), sha256(content(b, size))))
+                n = struct.unpack_from('>I', b, 496)[0]
+
+    walk(root, '')
+    return name(root), files
+
+
+PETSCII = {**{c: chr(c) for c in range(0x20, 0x5b)}, **{c: chr(c - 0x80) for c in range(0xc1, 0xdb)}}
+CBM_TYPES = ('DEL', 'SEQ', 'PRG', 'USR', 'REL')
+
+
+def cbm_dos(fmt: codec.DiskDef, tracks: Tracks) -> tuple[str, list[File]]:
+    "The directory on track 18, following each file's sector chain"
+    def sector(t: int, s: int) -> bytes:
+        key = (t - 1, 0) if t <= 35 else (t - 36, 1)
+        data = tracks.get(key)
+        if data is None or not 0 < t <= 35 * fmt.heads or (s + 1) * 256 > len(data):
+            raise Uncataloged(f"sector {t}/{s} isn't on the disk")
+        return data[s * 256:(s + 1) * 256]
+
+    def petscii(raw: bytes) -> str:
+        return ''.join(PETSCII.get(c, '?') for c in raw.rstrip(b'\xa0'))
+
+    bam = sector(18, 0)
+    if bam[2] != 0x41:
+        raise Uncataloged("no BAM on track 18")
+    files = []
+    seen = set()
+    t, s = bam[0], bam[1]
+    while t and (t, s) not in seen:
+        seen.add((t, s))
+        d = sector(t, s)
+        for i in range(8):
+            e = d[i * 32:(i + 1) * 32]
+            ftype = e[2]
+            if not ftype:
+                continue
+            out = []
+            ft, fs = e[3], e[4]
+            chain = set()
+            while ft and (ft, fs) not in chain:
+                chain.add((ft, fs))
+                b = sector(ft, fs)
+                out.append(b[2:b[1] + 1] if not b[0] else b[2:])
+                ft, fs = b[0], b[1]
+            content = b''.join(out)
+            kind = CBM_TYPES[ftype & 7] if ftype & 7 < len(CBM_TYPES) else '???'
+            # an unclosed "splat" file
+            if not ftype & 0x80:
+                kind += '*'
+            files.append(File(petscii(e[5:21]), len(content), None, sha256(content), kind))
+        t, s = d[0], d[1]
+    return petscii(bam[0x90:0xa0]), files
+
+
+MAC_EPOCH = datetime(1904, 1, 1)
+
+
+def mac(fmt: codec.DiskDef, tracks: Tracks) -> tuple[str, list[File]]:
+    "The MFS directory, or the HFS catalog tree"
+    data = linear(fmt, tracks)
+    mdb = data[1024:1536]
+    if len(mdb) < 512:
+        raise Uncataloged("the disk is too small")
+    signature = struct.unpack_from('>H', mdb, 0)[0]
+
+    def pascal(b: bytes, offset: int, limit: int=255) -> str:
+        return b[offset + 1:offset + 1 + min(b[offset], limit)].decode('mac_roman')
+
+    def timestamp(seconds: int) -> datetime | None:
+        return MAC_EPOCH + timedelta(seconds=seconds) if seconds else None
+
+    def kind(finfo: bytes) -> str:
+        return f"{finfo[:4].decode('mac_roman')}/{finfo[4:8].decode('mac_roman')}"
+
+    files = []
+    if signature == 0xd2d7:
+        (dir_start, dir_length, nblocks, block_size) = struct.unpack_from('>HHHI', mdb, 14)
+        first_block = struct.unpack_from('>H', mdb, 28)[0]
+
+        def entry(n: int) -> int:
+            # the 12 bit allocation map entries start at offset 64, for block 2 up
+            i = n - 2
+            v = struct.unpack_from('>H', data, 1024 + 64 + i * 3 // 2)[0]
+            return v & 0xfff if i & 1 else v >> 4
+
+        def fork(start: int, length: int) -> bytes:
+            out = []
+            n = start
+            while 2 <= n < nblocks + 2 and len(out) <= nblocks:
+                offset = first_block * 512 + (n - 2) * block_size
+                out.append(data[offset:offset + block_size])
+                n = entry(n)
+            return b''.join(out)[:length]
+
+        for b in range(dir_start, dir_start + dir_length):
+            blk = data[b * 512:(b + 1) * 512]
+            pos = 0
+            while pos + 51 <= 512 and blk[pos] & 0x80:
+                (flags, version, finfo, number, start, length, plength, rstart, rlength,
+                 rplength, created, modified) = struct.unpack_from('>BB16sIHIIHIIII', blk, pos)
+                name = pascal(blk, pos + 50)
+                files.append(File(name, length, timestamp(modified), sha256(fork(start, length)),
+                                  kind(finfo), rlength))
+                pos += (51 + blk[pos + 50] + 1) & ~1
+        return pascal(mdb, 36), files
+
+    if signature != 0x4244:
+        raise Uncataloged("no MFS or HFS volume")
+    block_size = struct.unpack_from('>I', mdb, 20)[0]
+    first_block = struct.unpack_from('>H', mdb, 28)[0]
+    if not block_size or block_size % 512:
+        raise Uncataloged("bad allocation block size")
+
+    def extents(record: bytes, offset: int, length: int) -> bytes | None:
+        "The bytes in an extent record, or None if it needs the extents overflow file"
+        out = []
+        for i in range(3):
+            start, count = struct.unpack_from('>HH', record, offset + 4 * i)
+            base = first_block * 512 + start * block_size
+            out.append(data[base:base + count * block_size])
+        out = b''.join(out)
+        return out[:length] if len(out) >= length else None
+
+    catalog = extents(mdb, 150, struct.unpack_from('>I', mdb, 146)[0])
+    if not catalog:
+        raise Uncataloged("the catalog is fragmented")
+    node_size = struct.unpack_from('>H', catalog, 14 + 18)[0]
+    if node_size != 512:
+        raise Uncataloged("unexpected catalog node size")
+    node = struct.unpack_from('>I', catalog, 14 + 10)[0]
+    directories = {}
+    found = []
+    seen = set()
+    while node and node not in seen and (node + 1) * 512 <= len(catalog):
+        seen.add(node)
+        n = catalog[node * 512:(node + 1) * 512]
+        flink, _, ntype, _, nrecs = struct.unpack_from('>IIbbH', n, 0)
+        if ntype != -1:
+            break
+        for i in range(nrecs):
+            offset = struct.unpack_from('>H', n, 510 - 2 * i)[0]
+            key_length = n[offset]
+            parent = struct.unpack_from('>I', n, offset + 2)[0]
+            name = pascal(n, offset + 6, 31)
+            d = n[offset + ((key_length + 2) & ~1):]
+            if d[0] == 1:
+                directories[struct.unpack_from('>I', d, 6)[0]] = (parent, name)
+            elif d[0] == 2:
+                length, = struct.unpack_from('>I', d, 26)
+                rlength, = struct.unpack_from('>I', d, 36)
+                modified, = struct.unpack_from('>I', d, 48)
+                content = extents(d, 74, length)
+                found.append((parent, File(name, length, timestamp(modified),
+                                           sha256(content) if content is not None else None,
+                                           kind(d[4:12]), rlength)))
+        node = flink
+
+    def path(directory: int) -> str:
+        parts = []
+        # the root directory is 2, its parent is 1
+        while directory in directories and directory != 2 and len(parts) < len(directories):
+            directory, name = directories[directory]
+            parts.insert(0, name)
+        return ''.join(f"{p}/" for p in parts)
+
+    for parent, f in found:
+        f.path = path(parent) + f.path
+        files.append(f)
+    return pascal(mdb, 36, 27), files
+
+
+def filesystems(format: str) -> list:
+    """The filesystems a disk in the format might have, most likely first"""
+    if format.startswith('ibm.'):
+        return [fat12, mac]
+    if format.startswith('mac.'):
+        return [mac]
+    if format.startswith('amiga.'):
+        return [amigados]
+    if format in ('commodore.1541', 'commodore.1571'):
+        return [cbm_dos]
+    return []
+
+
+def list_files(format: str, fmt: codec.DiskDef, tracks: Tracks) -> tuple[str, str, list[File]] | None:
+    """The filesystem, the volume name and the files on a disk, or None if
+    there's no filesystem that can be read"""
+    for parse in filesystems(format):
+        try:
+            volume, files = parse(fmt, tracks)
+            return parse.__name__, volume, files
+        except Uncataloged as e:
+            logging.debug(f"Not {parse.__name__}: {e}")
+        except (struct.error, IndexError, ValueError, OverflowError, UnicodeDecodeError) as e:
+            logging.info(f"The {parse.__name__} filesystem is damaged: {e}")
+    return None
@@ -0,0 +1,89 @@
+#!/bin/env python3
+"""Finding disks that have already been imaged
+
+Collections tend to have many copies of the same disk.  Each image that's
+read is recorded in a SQLite index under a fingerprint made from the
+decoded data of a few key tracks (track 0 on each head and the track the
+directory is on), and read_image reads those tracks first so a copy can
+be spotted after a few seconds instead of after the whole disk.
+"""
+from datetime import datetime
+import hashlib
+import os
+from pathlib import Path
+import sqlite3
+import threading
+from greaseweazle.codec import codec
+
+
+INDEX_FILE = Path(os.environ.get('XDG_DATA_HOME', Path.home() / '.local' / 'share'), 'FloppyDiskReader', 'fingerprints.db')
+
+# the (cyl, head) the directory is on, by the start of the format name.  PC
+# style disks have their FAT and root directory on track 0 already
+DIRECTORY_TRACKS = {
+    'commodore.1541': [(17, 0)],
+    'commodore.1571': [(17, 0)],
+    'commodore.1581': [(39, 0)],
+    'amiga': [(40, 0)],
+}
+
+SCHEMA = """
+create table if not exists disks (
+    id integer primary key,
+    fingerprint text not null,
+    format text not null,
+    image text not null,
+    duplicate_of text,
+    created text not null
+);
+create index if not exists disks_fingerprint on disks (fingerprint);
+"""
+
+
+def key_tracks(format: str, fmt: codec.DiskDef) -> list[tuple[int, int]]:
+    """The tracks a fingerprint is made from for the format"""
+    keys = [(0, h) for h in range(fmt.heads)]
+    for prefix, tracks in DIRECTORY_TRACKS.items():
+        if format.startswith(prefix):
+            keys.extend(t for t in tracks if t not in keys and t[0] < fmt.cyls and t[1] < fmt.heads)
+            break
+    return keys
+
+
+def fingerprint(format: str, digests: list[str]) -> str:
+    """Combine the key track digests, in key track order, into a fingerprint"""
+    h = hashlib.sha256(format.encode())
+    for d in digests:
+        h.update(bytes.fromhex(d))
+    return h.hexdigest()
+
+
+class FingerprintIndex:
+    """The index of the disks that have been imaged so far.  It can be used
+    from any thread."""
+    def __init__(self, filename: Path=INDEX_FILE):
+        self.filename = Path(filename)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            self.db.executescript(SCHEMA)
+
+
+    def lookup(self, fp: str) -> list[sqlite3.Row]:
+        """The original images with this fingerprint, oldest first"""
+        with self._lock:
+            return self.db.execute("select * from disks where fingerprint=? and duplicate_of is null order by id",
+                                   (fp,)).fetchall()
+
+
+    def add(self, fp: str, format: str, image, duplicate_of: str=None):
+        with self._lock, self.db:
+            self.db.execute("insert into disks (fingerprint, format, image, duplicate_of, created) values (?, ?, ?, ?, ?)",
+                            (fp, format, str(image), duplicate_of, datetime.now().isoformat(timespec='seconds')))
+
+
+    def close(self):
+        with self._lock:
+            self.db.close()
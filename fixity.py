@@ -0,0 +1,97 @@
+#!/bin/env python3
+"""Fixity hashes and the preservation manifest for an image
+
+The digests are worked out while the disk is read instead of reading the
+image back afterwards:  each track's image data is hashed as the track is
+finished and the whole image is hashed as it's written.  They're saved in
+a JSON manifest next to the image along with what the image was read from
+and which sectors were bad.  The per-track digests make it possible to
+check part of an image without hashing all of it.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+import time
+from greaseweazle.codec import codec
+
+
+MANIFEST_SUFFIX = '.manifest.json'
+IMAGE_DIGESTS = ('md5', 'sha256')
+TRACK_DIGEST = 'sha256'
+
+
+def manifest_file(filename) -> Path:
+    filename = Path(filename)
+    return filename.parent / (filename.name + MANIFEST_SUFFIX)
+
+
+def load_manifest(filename) -> dict | None:
+    """The manifest written for an image, if there is one"""
+    try:
+        with open(manifest_file(filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def track_digest(data: bytes) -> str:
+    return hashlib.new(TRACK_DIGEST, data).hexdigest()
+
+
+class Fixity:
+    """Digests and the bad sector map for one image as it's read"""
+    def __init__(self, **info):
+        self.info = info
+        self.rpm: float = None
+        self.tracks: dict[tuple[int, int], str] = {}
+        self.bad_sectors: dict[tuple[int, int], str] = {}
+        self.not_read: set[tuple[int, int]] = set()
+        self.image = {name: hashlib.new(name) for name in IMAGE_DIGESTS}
+        self.size = 0
+
+
+    def add_track(self, cyl: int, head: int, data: bytes, dat: codec.Codec, read: bool=True):
+        "Hash a finished track and note its bad sectors, or that it was filled in"
+        self.tracks[(cyl, head)] = track_digest(data)
+        if not read:
+            self.not_read.add((cyl, head))
+        if dat.nr_missing():
+            self.bad_sectors[(cyl, head)] = ''.join('.' if dat.has_sec(i) else 'B' for i in range(dat.nsec))
+        else:
+            self.bad_sectors.pop((cyl, head), None)
+
+
+    def write_image(self, f, data: bytes, chunk: int=1 << 20):
+        "Write the image to the open file, hashing it on the way"
+        view = memoryview(data)
+        for i in range(0, len(view), chunk):
+            block = view[i:i + chunk]
+            f.write(block)
+            for h in self.image.values():
+                h.update(block)
+        self.size += len(view)
+
+
+    def manifest(self, **extra) -> dict:
+        return {**self.info,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'rpm': round(self.rpm, 2) if self.rpm else None,
+                'size': self.size,
+                **{name: h.hexdigest() for name, h in self.image.items()},
+                'track_digest': TRACK_DIGEST,
+                'tracks': {f"{c}.{h}": digest for (c, h), digest in sorted(self.tracks.items())},
+                'bad_sectors': {f"{c}.{h}": bad for (c, h), bad in sorted(self.bad_sectors.items())},
+                'not_read': [f"{c}.{h}" for c, h in sorted(self.not_read)],
+                **extra}
+
+
+    def save(self, filename, **extra) -> dict:
+        "Write the manifest for the image filename"
+        manifest = self.manifest(**extra)
+        try:
+            with open(manifest_file(filename), "w") as f:
+                json.dump(manifest, f, indent=2)
+        except OSError as e:
+            logging.warning(f"Cannot write the manifest for {filename}: {e}")
+        return manifest
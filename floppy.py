@@ -1,16 +1,35 @@
 #!/bin/env python3
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Tuple
 from greaseweazle.tools import util
 from greaseweazle import error
 from greaseweazle import usb as USB
 from greaseweazle.flux import Flux, HasFlux
 from greaseweazle.codec import codec
-from greaseweazle.codec.codec import DiskDef_File
 from greaseweazle.image import image
 from greaseweazle import track
+from checkpoint import Checkpoint, checkpoint_file, restore_track
+from catalog import Catalog
+import diagnostics
+from fingerprint import FingerprintIndex, fingerprint, key_tracks
+from fixity import Fixity, load_manifest
+import fluxstream
+from fluxstream import FluxStreamWriter
+import fsmap
+import fluxstats
+from telemetry import Telemetry, summary_file, telemetry_file
+from registry import registry
+import simulator
 import logging
+import math
+from pathlib import Path
 from pydantic import BaseModel, Field, field_validator
+import sqlite3
 import sys
+import threading
+import time
 import yaml
 
 
@@ -21,14 +40,31 @@ drive_params = {
     '3.5HD': {'tracks': 80, 'heads': 2, 'rpm': 300}
 }
 
+# the drive's disk change (or ready) line
+DISK_CHANGE_PIN = 34
+
 
 class FloppyReaderConfig(BaseModel):
     """
     Structure of the configuration file
     """
     class GreaseWeazleConfig(BaseModel):
+        class SimulationConfig(BaseModel):
+            # only used when the port is sim:<path to an image or flux stream>
+            format: str | None = Field(default=None)
+            rpm: float = Field(default=300)
+            seek_ms: float = Field(default=3)
+            settle_ms: float = Field(default=15)
+            spinup_ms: float = Field(default=500)
+            realtime: bool = Field(default=True)
+
+        # only needed to tell units apart when there's more than one
+        name: str | None = Field(default=None)
         port: str = Field(default="auto")
         drives: dict[str | int, str] = Field(default_factory=dict)
+        # seconds to keep the drive spinning after an operation, 0 to stop it right away
+        motor_idle: float = Field(default=10, ge=0)
+        simulation: SimulationConfig = Field(default_factory=SimulationConfig)
 
         @field_validator('drives')
         @classmethod
@@ -44,10 +80,38 @@ class FloppyReaderConfig(BaseModel):
                 new[nk] = nv            
             return new
 
-    greaseweazle: GreaseWeazleConfig
+    # either a single greaseweazle or a list of them
+    greaseweazle: GreaseWeazleConfig | list[GreaseWeazleConfig]
     
     formats: dict[str, list[list[str] | str]]
 
+    @field_validator('greaseweazle')
+    @classmethod
+    def check_units(cls, value):
+        if isinstance(value, list):
+            if not value:
+                raise ValueError("At least one greaseweazle must be configured")
+            names = [u.name or str(i) for i, u in enumerate(value)]
+            if len(set(names)) != len(names):
+                raise ValueError("Greaseweazle names must be unique")
+            ports = [u.port for u in value]
+            if len(value) > 1 and ('auto' in ports or len(set(ports)) != len(ports)):
+                raise ValueError("Each greaseweazle needs its own port when there's more than one")
+        return value
+
+    def units(self) -> dict[str, tuple[str, GreaseWeazleConfig]]:
+        """Get the greaseweazle configs by unit name, along with the prefix
+        used for the names of their drives.  A single greaseweazle keeps the
+        plain drive letters, with a list they become <unit name>:<letter>
+        """
+        if not isinstance(self.greaseweazle, list):
+            return {self.greaseweazle.name or "0": ("", self.greaseweazle)}
+        units = {}
+        for i, u in enumerate(self.greaseweazle):
+            name = u.name or str(i)
+            units[name] = (f"{name}:", u)
+        return units
+
     @field_validator('formats')
     @classmethod
     def check_formats(cls, value: dict):
@@ -63,7 +127,7 @@ class FloppyReaderConfig(BaseModel):
                 else:
                     nv.append(x)
             # make sure each of the formats are actually supported by the greaseweazle
-            all_formats = codec.get_all_formats('', DiskDef_File(None))
+            all_formats = registry.all_formats()
             for x in nv:
                 if x not in all_formats:
                     raise ValueError(f"Format {x} not supported")
@@ -71,30 +135,189 @@ class FloppyReaderConfig(BaseModel):
             new[nk] = nv
         return new
 
+    @classmethod
+    def load(cls, filename) -> "FloppyReaderConfig":
+        """Load the configuration file, using the cached copy if the file
+        hasn't changed since it was last validated"""
+        cached = registry.cached_config(filename)
+        if cached is not None:
+            return cls.model_validate(cached)
+        with open(filename) as f:
+            config = cls(**yaml.safe_load(f))
+        registry.store_config(filename, config.model_dump(mode='json'))
+        return config
+
+
+def drive_name(name: str) -> str:
+    """Normalize a drive name as typed by the user.  Only the drive letter
+    is uppercased, the unit name in <unit name>:<letter> keeps its case"""
+    unit, sep, letter = str(name).rpartition(':')
+    return f"{unit}{sep}{letter.upper()}"
+
+
+def track_log_entry(message: dict) -> str:
+    """Format a read_image callback message for a disk log"""
+    if 'logical_cylinder' not in message:
+        # not about a track, such as the end of a retry pass
+        return f"{message['message']}\n"
+    return f"{message['logical_cylinder']}.{message['head']}: {message['message']}\n  {message['dat']}\n  {message['flux']}\n"
+
+
+class TrackMessage(Mapping):
+    """A read_image callback message.  The flux and track summaries are
+    only worked out when something looks at them, and the flux and track
+    are let go of once they have been.  dict(message) gives a plain copy.
+    """
+    __slots__ = ('_values', '_lazy')
+
+    def __init__(self, values: dict, **lazy: Callable[[], object]):
+        self._values = values
+        self._lazy = lazy
+
+    def __getitem__(self, key):
+        if key in self._lazy:
+            self._values[key] = self._lazy.pop(key)()
+        return self._values[key]
+
+    def __iter__(self):
+        return iter([*self._values, *self._lazy])
+
+    def __len__(self):
+        return len(self._values) + len(self._lazy)
+
+    def __contains__(self, key):
+        return key in self._values or key in self._lazy
+
+
+def best_format(probed: dict[str, tuple]) -> str:
+    """Pick the most likely format from probe() results: the largest
+    percentage found and then the largest geometry"""
+    return max(probed, key=lambda x: probed[x])
+
+
+class DriveSession:
+    """Keep a drive on a greaseweazle selected and spinning between
+    operations, so a probe followed by a read only spins the disk up once.
+    The motor is turned off and the drive deselected once nothing has used
+    it for idle_timeout seconds, or when another drive on the same
+    greaseweazle is wanted.
+
+    All of the methods other than close() expect the unit's lock to be held.
+    """
+    def __init__(self, gw: USB.Unit, lock: threading.RLock, idle_timeout: float):
+        self.gw = gw
+        self.lock = lock
+        self.idle_timeout = idle_timeout
+        self.drv: util.Drive = None
+        self.motor = False
+        self.timer: threading.Timer = None
+
+    def acquire(self, drv: util.Drive, motor: bool):
+        "Make sure the drive is selected, and spinning if motor is set"
+        # something that doesn't need the motor leaves it counting down
+        if self.timer and (motor or self.drv is not drv):
+            self.timer.cancel()
+            self.timer = None
+        if self.drv is not drv:
+            self.release()
+            self.gw.set_bus_type(drv.bus.value)
+            self.gw.drive_select(drv.unit_id)
+            self.drv = drv
+        if motor and not self.motor:
+            self.gw.drive_motor(drv.unit_id, True)
+            self.motor = True
+
+    def idle(self):
+        "The operation is done, start the clock on turning things off"
+        if self.timer:
+            return
+        if self.idle_timeout <= 0:
+            self.release()
+            return
+        self.timer = threading.Timer(self.idle_timeout, self._timeout)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _timeout(self):
+        with self.lock:
+            # the drive may have been picked up again while we were waiting
+            if self.timer is threading.current_thread():
+                self.timer = None
+                self.release()
+
+    def release(self):
+        "Turn off the motor and deselect the drive"
+        if self.drv is None:
+            return
+        drv = self.drv
+        self.drv = None
+        try:
+            if self.motor:
+                self.motor = False
+                self.gw.drive_motor(drv.unit_id, False)
+        finally:
+            self.gw.drive_deselect()
+
+    def abort(self):
+        "Something went badly wrong, reset the greaseweazle"
+        self.drv = None
+        self.motor = False
+        self.gw.reset()
+
+    def close(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.release()
+
 
 class FloppyReader:
     def __init__(self, config):
-        with open(config) as f:
-            self.config = FloppyReaderConfig(**yaml.safe_load(f))
-
-        # connect to the greaseweazle        
-        port = self.config.greaseweazle.port
-        self.gw: USB.Unit  = util.usb_open(None if port=='auto' else port)
+        self.config = FloppyReaderConfig.load(config)
 
-        # get the drive devices for everything..
         self.drives: dict[str, util.Drive] = {}
-        for d, t in self.config.greaseweazle.drives.items():
-            self.drives[d] = {
-                'type': t,
-                **drive_params[t],
-                'drive': util.Drive()(d)
-            }
+        self.units: dict[str, USB.Unit] = {}
+        self.unit_locks: dict[str, threading.RLock] = {}
+        self.sessions: dict[str, DriveSession] = {}
+        for unit, (prefix, gwconfig) in self.config.units().items():
+            # get the drive devices for everything..
+            unit_drives = {}
+            for d, t in gwconfig.drives.items():
+                unit_drives[prefix + d] = {
+                    'type': t,
+                    **drive_params[t],
+                    'drive': util.Drive()(d),
+                    'unit': unit
+                }
+            self.drives.update(unit_drives)
 
-        self.extension_map = {}        
-        for suffix in util.image_types:
-            iclass = util.get_image_class('x' + suffix)
-            if iclass.default_format:
-                self.extension_map[iclass.default_format] = (suffix, iclass)
+            # connect to the greaseweazle        
+            port = gwconfig.port
+            if port.startswith(simulator.PORT_PREFIX):
+                sim = gwconfig.simulation
+                gw = simulator.SimulatedUnit(
+                    port[len(simulator.PORT_PREFIX):], sim.format,
+                    {(d['drive'].bus.value, d['drive'].unit_id): d['tracks'] for d in unit_drives.values()},
+                    rpm=sim.rpm, seek_ms=sim.seek_ms, settle_ms=sim.settle_ms,
+                    spinup_ms=sim.spinup_ms, realtime=sim.realtime)
+            else:
+                gw = util.usb_open(None if port=='auto' else port)
+            self.units[unit] = gw
+            self.unit_locks[unit] = threading.RLock()
+            self.sessions[unit] = DriveSession(gw, self.unit_locks[unit], gwconfig.motor_idle)
+
+        # the first greaseweazle, for code that only knows about one
+        self.gw: USB.Unit = next(iter(self.units.values()))
+
+        self.extension_map: dict[str, str] = registry.extensions()
+
+        # the index of imaged disks, opened the first time it's needed
+        self._fingerprints: FingerprintIndex = None
+        self._fingerprints_lock = threading.Lock()
+        # and the catalog of the files on them
+        self._catalog: Catalog = None
+        self._catalog_lock = threading.Lock()
 
 
 
@@ -102,29 +325,74 @@ class FloppyReader:
         """Select the drive, optionally turn on the motor, and then run the function
         The function will be called with these arguments:
         function(the greaseweazle, the drive, *args, **kwargs)        
+
+        Only one drive on a greaseweazle can be used at a time, so this
+        waits for any other operation on the same greaseweazle to finish.
+
+        The drive is left selected and spinning afterwards so back to back
+        operations don't have to wait for it to spin up again.  It's turned
+        off after the configured motor_idle time, or by close().
         """
         if drive not in self.drives:
             raise KeyError("This drive is not configured")
         
         drv: util.Drive = self.drives[drive]['drive']        
-        self.gw.set_bus_type(drv.bus.value)        
-        res = None
-        try:
-            self.gw.drive_select(drv.unit_id)
-            self.gw.drive_motor(drv.unit_id, motor)
-            res = function(self.gw, drv, *args, **kwargs)
-        except KeyboardInterrupt:
-            self.gw.reset()
-            raise
-        finally:
-            self.gw.drive_motor(drv.unit_id, False)
-            self.gw.drive_deselect()
+        unit = self.drives[drive]['unit']
+        session = self.sessions[unit]
+        with self.unit_locks[unit]:
+            try:
+                session.acquire(drv, motor)
+                res = function(session.gw, drv, *args, **kwargs)
+            except KeyboardInterrupt:
+                session.abort()
+                raise
+            except BaseException:
+                try:
+                    session.release()
+                except Exception as e:
+                    logging.warning(f"Cannot release drive {drive}: {e}")
+                raise
+            session.idle()
         return res
 
 
+    def fingerprints(self) -> FingerprintIndex | None:
+        """The index of the disks that have been imaged, or None if it
+        can't be opened"""
+        with self._fingerprints_lock:
+            if self._fingerprints is None:
+                try:
+                    self._fingerprints = FingerprintIndex()
+                except (OSError, sqlite3.Error) as e:
+                    logging.warning(f"Cannot open the fingerprint index: {e}")
+            return self._fingerprints
+
+
+    def catalog(self) -> Catalog | None:
+        """The catalog of the files on the disks that have been imaged, or
+        None if it can't be opened"""
+        with self._catalog_lock:
+            if self._catalog is None:
+                try:
+                    self._catalog = Catalog()
+                except (OSError, sqlite3.Error) as e:
+                    logging.warning(f"Cannot open the catalog: {e}")
+            return self._catalog
+
+
     def reset(self):
-        """Reset the greaseweazle"""
-        self.gw.reset()
+        """Reset the greaseweazles"""
+        for unit, gw in self.units.items():
+            with self.unit_locks[unit]:
+                self.sessions[unit].drv = None
+                self.sessions[unit].motor = False
+                gw.reset()
+
+
+    def close(self):
+        """Turn off the motors and deselect the drives"""
+        for session in self.sessions.values():
+            session.close()
 
 
     def rpm(self, drive: str) -> float:
@@ -138,17 +406,118 @@ class FloppyReader:
         return r
 
 
+    def disk_state(self, drive: str) -> tuple[bool, bool]:
+        """Is there a disk in the drive, and has the door been opened since
+        the last time we looked?  Returns (present, changed).
+
+        PC drives hold the disk change line (pin 34) low from when the disk
+        is taken out until the heads are stepped with a disk in the drive,
+        so stepping and looking again says whether there's a disk.  When the
+        drive or the greaseweazle can't report the pin, the drive is spun
+        up and checked for index pulses instead.
+        """
+        params = self.drives[drive]
+
+        def check_pin(gw: USB.Unit, drv: util.Drive):
+            try:
+                if gw.get_pin(DISK_CHANGE_PIN):
+                    return True, False
+                # clear the latch, it only goes away when there's a disk
+                gw.seek(1, 0)
+                gw.seek(0, 0)
+                return bool(gw.get_pin(DISK_CHANGE_PIN)), True
+            except (AttributeError, error.CmdError) as e:
+                logging.info(f"Drive {drive} has no disk change line, looking for the index instead: {e}")
+                params['disk_change'] = False
+                return None
+
+        def check_index(gw: USB.Unit, drv: util.Drive):
+            try:
+                flux = gw.read_track(1)
+            except error.CmdError:
+                # no index pulses
+                return False, True
+            return bool(flux.index_list), not flux.index_list
+
+        if params.get('disk_change', True):
+            state = self.use_drive(check_pin, drive, motor=False)
+            if state is not None:
+                return state
+        return self.use_drive(check_index, drive, motor=True)
+
+
+    def diagnose(self, drive: str, cylinders: list[int]=None, revs: int=20,
+                 callback: Callable=None, save: bool=True) -> dict:
+        """Check the health of the drive with a disk in it.
+           Many revolutions are captured on each of the cylinders (by default
+           the first, middle and last one) and analyzed for the rotation speed,
+           wow and flutter, index jitter and the spread of the flux timing.
+
+           The callback gets progress messages and can return True to stop.
+
+           Returns {'drive', 'type', 'nominal_rpm', 'revs', 'cylinders': {cyl: figures},
+           'summary': figures for the whole drive}.  Unless save is False, the
+           result is added to the drive's history.
+        """
+        if drive not in self.drives:
+            raise KeyError("This drive is not configured")
+        if callback is None:
+            callback = lambda x: False
+        params = self.drives[drive]
+        if cylinders is None:
+            cylinders = sorted({0, params['tracks'] // 2, params['tracks'] - 1})
+
+        def capture(gw: USB.Unit, drv: util.Drive) -> dict[int, dict]:
+            res = {}
+            for i, cyl in enumerate(cylinders):
+                if callback({'message': f"Capturing {revs} revolutions on cylinder {cyl}",
+                             'progress': i / len(cylinders)}):
+                    return None
+                gw.seek(cyl, 0)
+                res[cyl] = diagnostics.analyze(gw.read_track(revs))
+            return res
+
+        res = self.use_drive(capture, drive, motor=True)
+        if res is None:
+            return None
+        result = {'drive': drive,
+                  'type': params['type'],
+                  'nominal_rpm': params['rpm'],
+                  'revs': revs,
+                  'cylinders': res,
+                  'summary': diagnostics.summarize(res, params['rpm'])}
+        callback({'message': "Diagnostics complete", 'progress': 1})
+        if save:
+            try:
+                diagnostics.save(drive, result)
+            except OSError as e:
+                logging.warning(f"Cannot save the diagnostics for drive {drive}: {e}")
+        return result
+
+
     def get_formats_for_drive(self, drive: str) -> dict[str, codec.DiskDef]:
         """Get a list of the formats supported for that drive"""
-        return {f: codec.get_diskdef(f) for f in self.config.formats.get(self.drives[drive]['type'], [])}
+        return {f: registry.get_diskdef(f) for f in self.config.formats.get(self.drives[drive]['type'], [])}
         
 
-    def probe(self, drive: str, callback: Callable = None) -> dict[str, tuple[float, int]]:
+    def probe(self, drive: str, callback: Callable = None, exhaustive: bool=False,
+              telemetry: Telemetry=None) -> dict[str, tuple[float, int]]:
         """Look at the drive and try to figure out what disk is in there
             We're going to do this by reading the first track and see if it works.
             We're not going to deal with the weird CP/M machines that had an FM
               track on 0, but MFM elsewhere.        
 
+            Track 0 is captured once per head in a single drive session and
+            every candidate format is decoded against that same flux, so the
+            probe costs one capture no matter how many formats are configured.
+            The flux is checked against each format's data rate, rotation
+            speed and encoding first, and only the formats it fits are
+            decoded, best fit and largest first.  Unless exhaustive is set
+            the probe stops at the first format that reads 100%.
+
+            If a Telemetry is given, the capture and each decode are
+            recorded in it.
+
             Returns a dictionary of all of the found formats with tuples indicating
             their % of sectors found and their guesstimated total capacity.  
             
@@ -159,57 +528,168 @@ class FloppyReader:
             raise KeyError("This drive is not configured")
         
         if callback is None: 
-            callback = lambda x: x
+            callback = lambda x: False
         
         drive_params = self.drives[drive]
         formats = self.get_formats_for_drive(drive)
         if not formats:
             raise ValueError(f"No formats defined for drive type {self.drives[drive]['type']}")
-    
-        def probe_track(gw: USB.Unit, drv: util.Drive, format_name: str, fmt: codec.DiskDef) -> Tuple[float, int]:
-            "Returns a tuple of percentage of sectors read for this format and the total number of sectors"
+
+        candidates: dict[str, codec.DiskDef] = {}
+        for format_name, fmt in formats.items():
+            if fmt.cyls > drive_params['tracks'] or fmt.heads > drive_params['heads']:
+                logging.warning(f"Skipping format {format_name} because it is incompatible with the drive")
+                continue
+            candidates[format_name] = fmt
+        if not candidates:
+            return {}
+
+        def capture_track0(gw: USB.Unit, drv: util.Drive, heads: int) -> list[Flux]:
+            "Capture track 0 of each head once so every format can share it"
+            fluxes = []
+            for h in range(heads):
+                if callback({'message': f"Reading track 0, head {h}",
+                             'progress': 0}):
+                    return None
+                started = time.perf_counter()
+                gw.seek(0, h)
+                sought = time.perf_counter()
+                fluxes.append(gw.read_track(2))
+                if telemetry:
+                    telemetry.record('probe_capture', drive=drive, head=h, seek=round(sought - started, 4),
+                                     capture=round(time.perf_counter() - sought, 4), revs=2)
+            return fluxes
+
+        heads = max(fmt.heads for fmt in candidates.values())
+        fluxes = self.use_drive(capture_track0, drive, heads)
+        if fluxes is None:
+            return {}
+
+        def probe_track(fmt: codec.DiskDef) -> Tuple[float, int, int, int]:
+            "Returns a tuple of percentage of sectors read for this format and the geometry"
             total_expected = 0
             total_missing = 0            
             for h in range(fmt.heads):
-                gw.seek(0, h)
-                flux = gw.read_track(2)             
-                dat = fmt.decode_flux(0, h, flux)             
+                dat = fmt.decode_flux(0, h, fluxes[h])
                 if dat.nr_missing() == dat.nsec:                    
                     return (0, 0, 0, 0)
                 total_expected += dat.nsec
                 total_missing += dat.nr_missing()                
                             
-            #return (100 * (total_expected - total_missing) / total_expected, fmt.heads * fmt.cyls * dat.nsec)
             return (100 * (total_expected - total_missing) / total_expected, fmt.heads, fmt.cyls, dat.nsec)
 
+        profile = fluxstats.profile(fluxes[0])
+        logging.debug(f"Track 0 of {drive}: {profile.describe()}")
+        ranked = fluxstats.rank(profile, candidates)
+        if telemetry:
+            telemetry.record('probe_profile', drive=drive, rpm=round(60 / profile.rev_time, 2) if profile.rev_time else 0,
+                             encoding=profile.encoding, cell=profile.cell, candidates=len(candidates), ranked=ranked)
+
         res = {}
         current = 0
-        total = len(formats)
-        for format_name in formats:                        
-            fmt: codec.DiskDef = formats[format_name] #codec.get_diskdef(format_name)   
+        total = len(ranked)
+        for format_name in ranked:
             if callback({'message': f"Probing {format_name}",
                          'progress': current / total}):                
                 return {}
             current += 1
-            if fmt.cyls > drive_params['tracks'] or fmt.heads > drive_params['heads']:
-                logging.warning(f"Skipping format {format_name} because it is incompatible with the drive")
-                continue
-            pct, h, c, s = self.use_drive(probe_track, drive, format_name, fmt)
+            started = time.perf_counter()
+            pct, h, c, s = probe_track(candidates[format_name])
+            if telemetry:
+                telemetry.record('probe_decode', drive=drive, format=format_name,
+                                 decode=round(time.perf_counter() - started, 4), percent=pct)
             if pct > 0:
                 res[format_name] = (pct, h, c, s)
+            if pct == 100 and not exhaustive:
+                break
         return res
     
 
     def get_extension_for_format(self, format: str) -> str:
         """Get a list of acceptable file extensions for the format in question"""        
-        return self.extension_map.get(format, ('.img', None))[0]
+        return self.extension_map.get(format, '.img')
 
 
     def read_image(self, drive: str, format: str, filename: str,
                    track_min: int=0, track_max=81, head_min=0,
-                   head_max=2, max_retries=3, callback: Callable=None):
+                   head_max=2, max_retries=3, callback: Callable=None,
+                   pipelined: bool=False, adaptive: bool=True,
+                   flux_file: str=None, resume: bool=False,
+                   deferred: bool=False, time_budget: float=None,
+                   telemetry: bool=True, manifest: bool=True,
+                   duplicate_callback: Callable=None, sparse: bool=False,
+                   catalog: bool=True):
+        """Read the disk into an image file.
+            Each track is captured and decoded, retrying up to max_retries
+            times if there are missing sectors.  The callback gets a message
+            for every attempt and can cancel the read by returning True.
+            The messages are TrackMessage mappings, which only summarize the
+            flux and the track when their 'flux' and 'dat' are looked at.
+
+            The sectors found by every attempt are merged, so a track is
+            finished as soon as the attempts between them have read every
+            sector.  When adaptive is set the first attempt captures only the
+            revolutions the format needs (its default_revs, such as 1.1, where
+            a normal read captures at least 2) and each retry doubles that,
+            up to four times a normal read.
+
+            If flux_file is given every capture, retries included, is also
+            streamed into that flux stream file as the read goes.
+
+            Finished tracks are saved to a checkpoint next to the image
+            until the image is written.  With resume set, the tracks from an
+            earlier, unfinished read of the same image are used and only the
+            tracks that were missing or bad are captured again.
+
+            When pipelined is set the greaseweazle captures the next track
+            while the previous one is decoded on a worker thread.  Tracks
+            with missing sectors are sent back to the capture stage, and the
+            callbacks and emitted tracks come out in the same order as a
+            normal read.
+
+            When deferred is set the whole disk is swept once first and the
+            tracks with missing sectors are retried in later passes, each in
+            the opposite direction to the last to keep seeking down, rather
+            than retrying each track straight away, with each pass capturing
+            more revolutions than the last.  Tracks are reported as
+            they finish, and a message with 'pass' in it is sent at the end
+            of each pass with how many tracks the pass recovered.
+
+            If time_budget (in seconds) is given, no more retries are started
+            once it has been used up, and the tracks still waiting for one
+            are finished with the sectors read so far.
+
+            Unless telemetry is turned off, the seek, capture and decode
+            times and the sectors found for every track are written to a
+            JSON Lines file next to the image as they finish, and the totals
+            for the read to a summary file when it ends.
+
+            Unless manifest is turned off, the MD5 and SHA-256 of the image
+            and a SHA-256 of each track are worked out as the tracks finish
+            and the image is written, and saved with the drive, format, rpm
+            and bad sector map in a manifest next to the image.
+
+            Every whole disk read is added to the fingerprint index under a
+            hash of its key tracks (track 0 and the directory track).  Sparse
+            reads and reads of a range of tracks are left out, so they're
+            never taken as the original of a later full read.  If a
+            duplicate_callback is given those tracks are read first, and if
+            the disk matches one that's already been imaged the callback is
+            called with the index entries for it.  Returning True stops the
+            read and records the disk as a probable duplicate instead.
+
+            When sparse is set the filesystem's metadata (the FAT, the
+            AmigaDOS bitmap or the Commodore BAM) is read first and only the
+            tracks it says are in use are captured.  The rest are filled
+            with the format's fill byte and logged as not read.  Disks whose
+            filesystem can't be mapped are read in full.
+
+            Unless catalog is turned off, the finished tracks are kept and
+            once the image is written the files on it are added to the
+            content catalog.
+        """
         image_class: image.Image = util.get_image_class(filename)
-        fmt: codec.DiskDef = codec.get_diskdef(format)              
+        fmt: codec.DiskDef = registry.get_diskdef(format)
         img = image_class.to_file(filename, fmt, False, {})
         img.write_on_ctrl_c = True
         track_min = max(0, min(track_min, fmt.cyls))
@@ -217,66 +697,506 @@ class FloppyReader:
         head_min = max(0, min(head_min, fmt.heads))
         head_max = min(fmt.heads, head_max)
         step = 2 if self.drives[drive]['tracks'] > fmt.cyls else 1
+        revs = max(2, math.ceil(fmt.default_revs))
+        max_revs = 4 * revs if adaptive or deferred else revs
+        # seconds per revolution, for reading a fraction of one
+        rev_time = 60 / self.drives[drive]['rpm']
+        deadline = time.monotonic() + time_budget if time_budget is not None else None
         if callback is None:
             # create a do-nothing callback
-            callback = lambda x: x
+            callback = lambda x: False
 
-        total = (track_max - track_min) * (head_max - head_min)
-        
+        tracks = [(cyl, head) for cyl in range(track_min, track_max) for head in range(head_min, head_max)]
+        total = len(tracks)
+        # a disk can only be fingerprinted when all of its key tracks are read
+        keys = key_tracks(format, fmt)
+        keys = [tracks.index(k) for k in keys] if all(k in tracks for k in keys) else []
 
-        def reader(gw: USB.Unit, drv: util.Drive):            
-            current = 0
-            for cyl in range(track_min, track_max):
-                pcyl = cyl * step
-                for head in range(head_min, head_max): 
-                    gw.seek(pcyl, head)
-                    retries = max_retries
-                    current += 1
-                    while retries:
-                        flux = gw.read_track(max(2, fmt.default_revs))  
-                        dat = fmt.decode_flux(cyl, head, flux) 
-                        if dat.nr_missing() == 0:
-                            if callback({'success': True,
-                                         'message': 'successfully read track',
-                                         'head': head,
-                                         'logical_cylinder': cyl,
-                                         'physical_cylinder': pcyl,
-                                         'flux': flux.summary_string(),
-                                         'dat': dat.summary_string(),
-                                         'progress': current / total}):
-                                return False
+        def revs_for_attempt(attempt: int, pass_no: int) -> float:
+            if adaptive:
+                return min(fmt.default_revs * 2 ** attempt, max_revs)
+            if deferred:
+                # each retry pass captures more revolutions than the last
+                return min(revs * pass_no, max_revs)
+            return revs if attempt == 0 else max_revs
+
+        def message(success: bool, text: str, current: int, flux: Flux | None, dat, progress: float,
+                    retry: bool=False) -> TrackMessage:
+            cyl, head = tracks[current]
+            values = {'success': success,
+                      'retry': retry,
+                      'message': text,
+                      'head': head,
+                      'logical_cylinder': cyl,
+                      'physical_cylinder': cyl * step,
+                      'progress': progress}
+            lazy = {}
+            if flux is None:
+                values['flux'] = 'no flux'
+            else:
+                lazy['flux'] = flux.summary_string
+            if retry:
+                # the next attempt is merged into the same track, so it has to be summarized now
+                values['dat'] = dat.summary_string()
+            else:
+                lazy['dat'] = dat.summary_string
+            return TrackMessage(values, **lazy)
+
+
+        def reader(gw: USB.Unit, drv: util.Drive):
+            # with a single decode slot this is the plain capture, decode,
+            # emit loop.  Pipelining allows one capture to be in flight while
+            # the decoder thread is busy with the previous one.
+            decoder = ThreadPoolExecutor(max_workers=1) if pipelined else None
+            depth = 2 if pipelined else 1
+            todo = deque()
+            retry_later = []
+            inflight = deque()
+            attempts = [0] * total
+            dats = [None] * total
+            messages = [[] for _ in range(total)]
+            finished = [None] * total
+            next_emit = 0
+            nr_finished = 0
+            position = None
+            pass_no = 1
+            pass_recovered = 0
+            completed = False
+            # seconds seeking, capturing and decoding, and revolutions, per track
+            stats = [[0.0, 0.0, 0.0, 0] for _ in range(total)]
+
+            def progress(current: int) -> float:
+                # in order, the position on the disk.  Deferred, how much is done
+                return (nr_finished if deferred else current + 1) / total
+
+            saved = Checkpoint.load(checkpoint_file(filename), format) if resume else {}
+            tele = Telemetry(telemetry_file(filename) if telemetry else None, append=bool(saved),
+                             drive=drive, format=format, image=str(filename))
+            fixity = Fixity(image=Path(filename).name, format=format, drive=drive,
+                            drive_type=self.drives[drive]['type'])
+
+            # sparse reads start with only the tracks the filesystem map asks
+            # for, the others are held until it says which are in use
+            plan = fsmap.planner(format, fmt) if sparse else None
+            plan_data = {}
+            wanted = set()
+            held = deque()
+            # the track data for the content catalog
+            image_tracks = {}
+
+            def finish(current: int, dat, restored: bool=False, skipped: bool=False):
+                nonlocal nr_finished
+                finished[current] = dat
+                nr_finished += 1
+                data = bytes(dat.get_img_track())
+                fixity.add_track(*tracks[current], data, dat, read=not skipped)
+                if plan:
+                    plan_data[tracks[current]] = (dat.nr_missing() == 0, data)
+                if catalog:
+                    image_tracks[tracks[current]] = data
+                seek, capture, decode, revs = stats[current]
+                tele.track(*tracks[current], seek=seek, capture=capture, decode=decode, revs=revs,
+                           captures=attempts[current], sectors=dat.nsec - dat.nr_missing(), nsec=dat.nsec,
+                           bytes=len(data), restored=restored, skipped=skipped)
+
+            for current, (cyl, head) in enumerate(tracks):
+                complete, data = saved.get((cyl, head), (False, None))
+                if complete:
+                    finish(current, restore_track(fmt, cyl, head, data), restored=True)
+                    messages[current].append(message(True, 'restored track from checkpoint', current, None,
+                                                     finished[current], progress(current)))
+                else:
+                    todo.append(current)
+            if duplicate_callback:
+                # read the key tracks first so a copy is spotted quickly
+                first = [k for k in keys if k in todo]
+                todo = deque(first + [t for t in todo if t not in first])
+            if plan:
+                held, todo = todo, deque()
+            ckpt = Checkpoint(checkpoint_file(filename), format, saved)
+            archive = FluxStreamWriter(flux_file) if flux_file else None
+
+            def capture(current: int):
+                nonlocal position
+                cyl, head = tracks[current]
+                started = time.perf_counter()
+                if position != (cyl * step, head):
+                    position = (cyl * step, head)
+                    gw.seek(*position)
+                sought = time.perf_counter()
+                attempt = attempts[current]
+                nr_revs = revs_for_attempt(attempt, pass_no)
+                if nr_revs == int(nr_revs):
+                    flux = gw.read_track(int(nr_revs))
+                else:
+                    # stop partway through the last revolution
+                    flux = gw.read_track(math.ceil(nr_revs), ticks=int(nr_revs * rev_time * gw.sample_freq))
+                # a typed array of intervals instead of a list of ints for as
+                # long as the capture is around
+                flux = fluxstream.compact(flux)
+                if fixity.rpm is None and flux.index_list:
+                    fixity.rpm = 60 * flux.sample_freq / flux.index_list[-1]
+                stats[current][0] += sought - started
+                stats[current][1] += time.perf_counter() - sought
+                stats[current][3] += nr_revs
+                if decoder:
+                    return flux, decoder.submit(decode, current, attempt, flux)
+                return flux, decode(current, attempt, flux)
+
+            def decode(current: int, attempt: int, flux: Flux):
+                if archive:
+                    cyl, head = tracks[current]
+                    archive.write(cyl, cyl * step, head, attempt, flux)
+                # merge the sectors from this attempt with the earlier ones.
+                # There's never more than one capture of a track in flight,
+                # so this is safe to run on the decoder thread.
+                started = time.perf_counter()
+                if dats[current] is None:
+                    dats[current] = fmt.decode_flux(*tracks[current], flux)
+                else:
+                    dats[current].decode_flux(flux)
+                stats[current][2] += time.perf_counter() - started
+                return dats[current]
+
+            fp = None
+            checked = not keys
+            duplicate = None
+
+            def check_duplicate() -> bool:
+                "Once the key tracks are in, look for the disk in the index.  True to stop"
+                nonlocal fp, checked, duplicate
+                if checked or not all(tracks[k] in fixity.tracks for k in keys):
+                    return False
+                checked = True
+                if any(tracks[k] in fixity.bad_sectors or tracks[k] in fixity.not_read for k in keys):
+                    # a fingerprint of bad data wouldn't match anything
+                    return False
+                fp = fingerprint(format, [fixity.tracks[tracks[k]] for k in keys])
+                index = self.fingerprints() if duplicate_callback else None
+                matches = index.lookup(fp) if index else []
+                if not matches:
+                    return False
+                original = matches[0]['image']
+                if duplicate_callback(matches):
+                    duplicate = original
+                    index.add(fp, format, filename, duplicate_of=original)
+                    callback({'success': True, 'retry': False,
+                              'message': f'probable duplicate of {original}, stopped reading',
+                              'duplicate_of': original, 'progress': nr_finished / total})
+                    return True
+                return callback({'success': True, 'retry': False,
+                                 'message': f'probable duplicate of {original}, reading it anyway',
+                                 'duplicate_of': original, 'progress': nr_finished / total})
+
+            def skip(current: int):
+                "Fill in a track the filesystem isn't using instead of reading it"
+                fill = fsmap.fill_byte(format)
+                dat = fmt.mk_track(*tracks[current])
+                dat.set_img_track(bytes([fill]) * len(dat.get_img_track()))
+                finish(current, dat, skipped=True)
+                messages[current].append(message(True, f'not read, not in use by the filesystem (filled with 0x{fill:02x})',
+                                                 current, None, dat, progress(current)))
+
+            def advance_plan(data: dict | None) -> bool:
+                "Give the filesystem map the tracks it asked for and queue the ones it wants next.  True if cancelled"
+                nonlocal plan, wanted
+                index = {t: i for i, t in enumerate(tracks)}
+                try:
+                    asked = plan.send(data)
+                except StopIteration as e:
+                    used = e.value
+                else:
+                    if all(t in index for t in asked):
+                        wanted = {index[t] for t in asked}
+                        todo.extend(t for t in held if t in wanted)
+                        held_rest = [t for t in held if t not in wanted]
+                        held.clear()
+                        held.extend(held_rest)
+                        return False
+                    # it needs tracks outside of what's being read
+                    plan.close()
+                    used = None
+                plan = None
+                if used is None:
+                    todo.extend(held)
+                else:
+                    for t in held:
+                        if tracks[t] in used:
+                            todo.append(t)
+                        else:
+                            skip(t)
+                            if deferred and report(t):
+                                return True
+                    unused = sum(t not in used for t in tracks)
+                    if callback({'success': True, 'retry': False,
+                                 'message': f'filesystem map: {total - unused} of {total} tracks in use, the rest are not read',
+                                 'progress': nr_finished / total}):
+                        return True
+                held.clear()
+                return False
+
+            def give_up(current: int, flux: Flux | None, out_of_time: bool):
+                "Finish a track that still has missing sectors with what has been read"
+                dat = dats[current]
+                bad = ''.join(['.' if dat.has_sec(i) else 'B' for i in range(dat.nsec)])
+                why = 'out of time, ' if out_of_time else ''
+                finish(current, dat)
+                messages[current].append(message(False, f'failed read track, {why}data may not be usable: [{bad}]',
+                                                 current, flux, dat, progress(current)))
+
+            def report(current: int) -> bool:
+                "Send the messages for a track and emit it if it's done.  True if cancelled"
+                for m in messages[current]:
+                    if callback(m):
+                        return True
+                messages[current].clear()
+                if finished[current] is not None:
+                    img.emit_track(*tracks[current], finished[current])
+                    finished[current] = dats[current] = None
+                return False
+
+            try:
+                if deferred:
+                    for current in range(total):
+                        if messages[current] and report(current):
+                            return False
+                if check_duplicate():
+                    return False
+                if plan and advance_plan(None):
+                    return False
+                while True:
+                    # report and emit everything that's next in line
+                    while not deferred and next_emit < total:
+                        waiting = finished[next_emit] is None
+                        if report(next_emit):
+                            return False
+                        if waiting:
                             break
-                        retries -= 1                      
-                        if callback({'success': False,
-                                     'message': 'failed read track, retrying',
-                                     'head': head,
-                                     'logical_cylinder': cyl,
-                                     'physical_cylinder': pcyl,
-                                     'flux': flux.summary_string(),
-                                     'dat': dat.summary_string(),
-                                     'progress': current / total}):
+                        next_emit += 1
+                    if nr_finished == total and not inflight:
+                        break
+
+                    if plan and not todo and not inflight and all(tracks[i] in plan_data for i in wanted):
+                        if advance_plan({tracks[i]: plan_data[tracks[i]] for i in wanted}):
                             return False
-                    else:                        
-                        bad = ''.join(['.' if dat.has_sec(i) else 'B' for i in range(dat.nsec)])
-                        if callback({'success': False,
-                                     'message': f'failed read track, data may not be usable: [{bad}]',
-                                     'head': head,
-                                     'logical_cylinder': cyl,
-                                     'physical_cylinder': pcyl,
-                                     'flux': flux.summary_string(),
-                                     'dat': dat.summary_string(),
-                                     'progress': current / total}):
+                        # the next tracks get their own passes
+                        pass_no = 1
+                        pass_recovered = 0
+                        continue
+                    if not todo and not inflight:
+                        if deadline is not None and time.monotonic() > deadline:
+                            # no time for another pass, the tracks waiting for one keep what they have
+                            for current in retry_later:
+                                give_up(current, None, out_of_time=True)
+                                ckpt.add(*tracks[current], finished[current])
+                                if check_duplicate() or report(current):
+                                    return False
+                            retry_later.clear()
+                            continue
+                        # start the next pass over the tracks that still have errors
+                        pass_no += 1
+                        pass_recovered = 0
+                        retry_later.sort(key=lambda x: tracks[x], reverse=pass_no % 2 == 0)
+                        todo.extend(retry_later)
+                        retry_later.clear()
+                    if todo and len(inflight) < depth:
+                        current = todo.popleft()
+                        inflight.append((current, *capture(current)))
+                        continue
+
+                    current, flux, dat = inflight.popleft()
+                    if decoder:
+                        dat = dat.result()
+                    attempts[current] += 1
+                    if dat.nr_missing() == 0:
+                        finish(current, dat)
+                        pass_recovered += 1
+                        messages[current].append(message(True, 'successfully read track', current, flux, dat,
+                                                         progress(current)))
+                    else:
+                        messages[current].append(message(False, 'failed read track, retrying', current, flux, dat,
+                                                         progress(current), retry=True))
+                        out_of_time = deadline is not None and time.monotonic() > deadline
+                        if attempts[current] < max_retries and not out_of_time:
+                            # send it back to the capture stage: straight away, or in
+                            # the next pass when deferring
+                            if deferred:
+                                retry_later.append(current)
+                            else:
+                                todo.appendleft(current)
+                        else:
+                            give_up(current, flux, out_of_time)
+                    if finished[current] is not None:
+                        ckpt.add(*tracks[current], finished[current])
+                        if check_duplicate():
                             return False
-                        
-                    img.emit_track(cyl, head, dat)
+                    if deferred and report(current):
+                        return False
+
+                    if deferred and not todo and not inflight:
+                        pending = len(retry_later)
+                        if pass_no > 1 or pending:
+                            tele.record('pass', number=pass_no, recovered=pass_recovered, remaining=pending)
+                            if callback({'success': True,
+                                         'retry': False,
+                                         'message': f'pass {pass_no} read {pass_recovered} tracks, {pending} still to retry',
+                                         'pass': pass_no,
+                                         'recovered': pass_recovered,
+                                         'remaining': pending,
+                                         'progress': nr_finished / total}):
+                                return False
+                completed = True
+            finally:
+                if decoder:
+                    decoder.shutdown(cancel_futures=True)
+                if archive:
+                    archive.close()
+                if duplicate:
+                    ckpt.remove()
+                ckpt.close()
+                tele.close(summary_file(filename) if telemetry else None, completed=completed,
+                           **({'duplicate_of': duplicate} if duplicate else {}))
 
             with open(filename, "wb") as f:
-                f.write(img.get_image())
+                fixity.write_image(f, img.get_image())
+            if manifest:
+                fixity.save(filename)
+            # only a whole disk can stand as the original for later reads,
+            # a sparse or track-limited image would hide the full one
+            whole = total == fmt.cyls * fmt.heads and not fixity.not_read
+            if fp and whole and (index := self.fingerprints()):
+                index.add(fp, format, filename)
+            if catalog and (contents := self.catalog()):
+                try:
+                    contents.add(filename, format, fmt, image_tracks)
+                except sqlite3.Error as e:
+                    logging.warning(f"Cannot catalog {filename}: {e}")
+            ckpt.remove()
 
             return True
                 
         return self.use_drive(reader, drive)
-  
+
+
+    def verify_image(self, drive: str, format: str, filename: str,
+                     track_min: int=0, track_max=81, head_min=0,
+                     head_max=2, max_retries=3, max_errors: int=0,
+                     callback: Callable=None) -> dict:
+        """Check that the disk in the drive still matches an image of it.
+            The image is loaded with the greaseweazle image classes and each
+            track is captured, decoded and its sectors compared with the
+            image's in memory, so nothing is written.  A track is only
+            captured again when sectors are missing, never once everything
+            that was found matches.
+
+            Sectors that were bad when the image was read, and tracks that
+            a sparse read didn't capture, are taken from the image's manifest
+            (if it has one) and aren't compared.
+
+            Verification stops once more than max_errors sectors are
+            different or can't be read, so by default at the first one.  The
+            callback gets the same messages as read_image, and can return
+            True to stop.
+
+            Returns {'match': True if every sector checked was the same,
+            'stopped': True if it gave up early, 'mismatched' and
+            'unreadable': the number of sectors, 'tracks': {"cyl.head": a
+            character per sector}} where the characters are . (the same),
+            X (different), B (couldn't be read) and - (not compared), or None
+            if the callback stopped it.
+        """
+        fmt: codec.DiskDef = registry.get_diskdef(format)
+        img = simulator.open_image(filename, fmt)
+        manifest = load_manifest(filename) or {}
+        known_bad = manifest.get('bad_sectors', {})
+        not_read = set(manifest.get('not_read', []))
+        track_min = max(0, min(track_min, fmt.cyls))
+        track_max = min(fmt.cyls, track_max)
+        head_min = max(0, min(head_min, fmt.heads))
+        head_max = min(fmt.heads, head_max)
+        step = 2 if self.drives[drive]['tracks'] > fmt.cyls else 1
+        revs = max(2, math.ceil(fmt.default_revs))
+        if callback is None:
+            callback = lambda x: False
+
+        tracks = [(cyl, head) for cyl in range(track_min, track_max) for head in range(head_min, head_max)]
+        total = len(tracks)
+        res = {'match': True, 'stopped': False, 'mismatched': 0, 'unreadable': 0, 'tracks': {}}
+
+        def compare(dat, expected: bytes, skip: str) -> str:
+            "A character for each sector of the track"
+            data = bytes(dat.get_img_track())
+            if len(data) != len(expected) or len(data) % dat.nsec:
+                # the sectors can't be lined up, so it's all or nothing
+                if dat.nr_missing():
+                    return 'B' * dat.nsec
+                return ('.' if data == expected else 'X') * dat.nsec
+            size = len(data) // dat.nsec
+            status = ''
+            for i in range(dat.nsec):
+                if i < len(skip) and skip[i] == 'B':
+                    status += '-'
+                elif not dat.has_sec(i):
+                    status += 'B'
+                else:
+                    status += '.' if data[i * size:(i + 1) * size] == expected[i * size:(i + 1) * size] else 'X'
+            return status
+
+        def verifier(gw: USB.Unit, drv: util.Drive):
+            for current, (cyl, head) in enumerate(tracks):
+                key = f"{cyl}.{head}"
+                trk = img.get_track(cyl, head)
+                if key in not_read or trk is None:
+                    res['tracks'][key] = '-' * (trk.nsec if trk is not None else 0)
+                    continue
+                expected = bytes(trk.get_img_track())
+                gw.seek(cyl * step, head)
+                dat = None
+                for attempt in range(max_retries + 1):
+                    flux = fluxstream.compact(gw.read_track(revs))
+                    if dat is None:
+                        dat = fmt.decode_flux(cyl, head, flux)
+                    else:
+                        dat.decode_flux(flux)
+                    status = compare(dat, expected, known_bad.get(key, ''))
+                    # a sector that decoded but is different won't get better with a retry
+                    done = 'B' not in status or 'X' in status or attempt == max_retries
+                    if status.count('X') and done:
+                        text = f"{status.count('X')} sectors don't match the image"
+                    elif status.count('B') and done:
+                        text = f"{status.count('B')} sectors can't be read"
+                    elif done:
+                        text = "matches the image"
+                    else:
+                        text = f"retrying, {status.count('B')} sectors missing"
+                    values = {'success': 'X' not in status and 'B' not in status,
+                              'retry': not done,
+                              'message': text,
+                              'head': head,
+                              'logical_cylinder': cyl,
+                              'physical_cylinder': cyl * step,
+                              'progress': (current + 1) / total}
+                    lazy = {'flux': flux.summary_string}
+                    if done:
+                        lazy['dat'] = dat.summary_string
+                    else:
+                        # a retry is merged into the same track, so it has to be summarized now
+                        values['dat'] = dat.summary_string()
+                    if callback(TrackMessage(values, **lazy)):
+                        return None
+                    if done:
+                        break
+                res['tracks'][key] = status
+                res['mismatched'] += status.count('X')
+                res['unreadable'] += status.count('B')
+                if res['mismatched'] + res['unreadable'] > max_errors:
+                    res['stopped'] = current + 1 < total
+                    break
+            res['match'] = not (res['mismatched'] or res['unreadable'])
+            return res
+
+        return self.use_drive(verifier, drive)
+
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
@@ -286,7 +1206,8 @@ def main():
         logging.info(f"Probe {d}: {fdr.probe(d)}")
     #for f in fdr.config.formats['5.25HD']:
     #    print(f, fdr.get_extension_for_format(f))
-    fdr.read_image("0", "commodore.1541", "/tmp/test.d64", callback=lambda x: print(yaml.safe_dump(x)))
+    fdr.read_image("0", "commodore.1541", "/tmp/test.d64", callback=lambda x: print(yaml.safe_dump(dict(x))))
+    fdr.close()
 
 if __name__ == "__main__":
     main()
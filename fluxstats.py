@@ -0,0 +1,152 @@
+#!/bin/env python3
+"""Flux interval statistics for probing
+
+Decoding a track with every configured format is the slow part of a probe.
+Most of the candidates can be ruled out much more cheaply by looking at the
+flux itself:  every encoding only produces a few interval lengths (MFM
+writes 2, 3 or 4 clock cells between transitions, GCR 1, 2 or 3) so the
+intervals of a capture, scaled to a format's revolution time and measured
+in that format's clock, should land on those lengths if the disk could be
+in that format.  A format with the wrong data rate, rotation speed or
+encoding doesn't line up and doesn't need to be decoded at all.
+"""
+import logging
+from typing import NamedTuple
+import numpy as np
+from greaseweazle.flux import Flux
+from greaseweazle.codec import codec
+
+
+# flux intervals each encoding produces, in the format's clock cells.  FM
+# can be clocked at the cell or half cell, so both are tried
+FAMILIES = {
+    'MFM': ((2, 3, 4),),
+    'FM': ((2, 4), (1, 2)),
+    'GCR': ((1, 2, 3),),
+}
+# the intervals, in bit cells, that recognize each encoding in a histogram
+SIGNATURES = {
+    'MFM': (2, 3, 4),
+    'GCR': (1, 2, 3),
+    'FM': (1, 2),
+}
+# how far from a whole number of cells an interval can be and still count
+TOLERANCE = 0.35
+# formats with less of the flux lining up than this aren't decoded
+MIN_FIT = 0.6
+# fewer intervals than this is an unformatted or blank track
+MIN_INTERVALS = 100
+
+
+class FluxProfile(NamedTuple):
+    intervals: np.ndarray   # seconds
+    rev_time: float         # seconds
+    cell: float             # estimated bit cell, seconds
+    encoding: str | None
+
+    def describe(self) -> str:
+        if not self.rev_time:
+            return "no index"
+        text = f"{60 / self.rev_time:.1f} RPM, {len(self.intervals)} flux intervals"
+        if self.encoding:
+            text += f", looks like {self.encoding} with a {1e6 * self.cell:.2f}us cell"
+        return text
+
+
+def histogram_peaks(intervals: np.ndarray, bins: int=200) -> np.ndarray:
+    "The interval lengths that the histogram of the intervals peaks at"
+    top = np.percentile(intervals, 99) * 1.2
+    hist, edges = np.histogram(intervals, bins=bins, range=(0, top))
+    hist = np.convolve(hist, np.ones(3) / 3, mode='same')
+    mid = hist[1:-1]
+    peaks = np.flatnonzero((mid > hist[:-2]) & (mid >= hist[2:]) & (mid > 0.05 * hist.max())) + 1
+    return (edges[peaks] + edges[peaks + 1]) / 2
+
+
+def guess_encoding(peaks: np.ndarray) -> tuple[str | None, float]:
+    "Match the peak ratios against the encodings, returning it and its cell"
+    if not len(peaks):
+        return None, 0
+    ratios = peaks / peaks[0]
+    for family, signature in SIGNATURES.items():
+        signature = np.asarray(signature, dtype=np.float64)
+        expected = np.abs(ratios[:, None] - signature[None, :] / signature[0]) < 0.1
+        # every expected interval is there and every peak is explained
+        if expected.any(axis=0).all() and expected.any(axis=1).all():
+            return family, peaks[0] / signature[0]
+    return None, 0
+
+
+def profile(flux: Flux) -> FluxProfile:
+    """Work out the revolution time and, where it can be, the encoding and
+    the bit cell of a capture"""
+    intervals = np.asarray(flux.list, dtype=np.float64) / flux.sample_freq
+    index = np.asarray(flux.index_list, dtype=np.float64) / flux.sample_freq
+    # the first index may be partial, so prefer the ones after it
+    rev_time = float(np.median(index[1:] if len(index) > 1 else index)) if len(index) else 0
+    if len(intervals) < MIN_INTERVALS:
+        return FluxProfile(intervals, rev_time, 0, None)
+    encoding, cell = guess_encoding(histogram_peaks(intervals))
+    return FluxProfile(intervals, rev_time, cell, encoding)
+
+
+def track_encoding(track: codec.Codec) -> str | None:
+    "The encoding family of a greaseweazle track, if it can be told"
+    mode = getattr(track, 'mode', None)
+    if mode is not None:
+        name = str(getattr(mode, 'name', mode)).upper()
+        if 'MFM' in name:
+            return 'MFM'
+        if 'FM' in name:
+            return 'FM'
+    module = type(track).__module__
+    if 'amiga' in module:
+        return 'MFM'
+    if any(x in module for x in ('c64', 'commodore', 'apple2', 'mac')):
+        return 'GCR'
+    return None
+
+
+def fit(flux: FluxProfile, track: codec.Codec) -> float | None:
+    """The fraction of the flux intervals that land on a whole number of the
+    track's clock cells, or None if the track can't be checked this way"""
+    family = track_encoding(track)
+    clock = getattr(track, 'clock', None)
+    time_per_rev = getattr(track, 'time_per_rev', None)
+    if family is None or not clock or not time_per_rev or not flux.rev_time:
+        return None
+    if len(flux.intervals) < MIN_INTERVALS:
+        return 0
+    if flux.encoding and flux.encoding != family:
+        # FM intervals line up with MFM clocks, so go by the histogram too
+        return 0
+    # scale to the format's rotation speed the way decoding does
+    cells = flux.intervals * (time_per_rev / flux.rev_time) / clock
+    best = 0
+    for multiples in FAMILIES[family]:
+        m = np.asarray(multiples, dtype=np.float64)
+        nearest = np.abs(cells[:, None] - m[None, :]).min(axis=1)
+        best = max(best, float(np.mean(nearest < TOLERANCE)))
+    return best
+
+
+def rank(flux: FluxProfile, formats: dict[str, codec.DiskDef], min_fit: float=MIN_FIT) -> list[str]:
+    """Order the formats by how well the flux fits them, leaving out the
+    ones that don't fit.  Formats that fit equally well are ordered by
+    capacity, largest first, and formats that can't be checked go last.
+    """
+    scored = []
+    for name, fmt in formats.items():
+        try:
+            track = fmt.mk_track(0, 0)
+            score = fit(flux, track)
+            capacity = fmt.cyls * fmt.heads * getattr(track, 'nsec', 0)
+        except Exception as e:
+            logging.debug(f"Cannot check the flux against {name}: {e}")
+            score, capacity = None, 0
+        if score is not None and score < min_fit:
+            logging.debug(f"Skipping {name}: only {100 * score:.0f}% of the flux fits it")
+            continue
+        scored.append(((score is None, -round(score or 0, 2), -capacity), name))
+    scored.sort(key=lambda x: x[0])
+    return [name for _, name in scored]
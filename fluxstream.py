@@ -0,0 +1,152 @@
+#!/bin/env python3
+"""Raw flux archive written alongside a disk image
+
+A flux stream is a gzip file holding a short header followed by one record
+for every capture made during a read, retries included.  Records are
+written and flushed as the captures happen, so nothing is held in memory
+and a stream cut short by a crash is still readable up to the last record.
+
+Each record is the fixed RECORD header followed by the index list and the
+flux intervals as little-endian 32-bit sample counts.
+"""
+from array import array
+import argparse
+import gzip
+import struct
+import sys
+from typing import Iterator, NamedTuple
+from greaseweazle.tools import util
+from greaseweazle.flux import Flux
+
+
+MAGIC = b'FDRFLUX\x01'
+# cyl, physical cyl, head, attempt, sample frequency, # of indexes, # of flux intervals
+RECORD = struct.Struct('<HHBBdII')
+SUFFIX = '.flux.gz'
+
+
+class FluxRecord(NamedTuple):
+    cyl: int
+    pcyl: int
+    head: int
+    attempt: int
+    flux: Flux
+
+
+def _to_bytes(values) -> bytes:
+    a = values if isinstance(values, array) and values.typecode == 'I' else array('I', values)
+    if sys.byteorder == 'big':
+        a = array('I', a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_bytes(data: bytes) -> array:
+    a = array('I')
+    a.frombytes(data)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def compact(flux: Flux) -> Flux:
+    """The same flux with the intervals in a 32-bit array instead of a list
+    of ints, which is a fraction of the size and can be decoded and
+    written to a stream as it is"""
+    if isinstance(flux.list, array):
+        return flux
+    try:
+        intervals = array('I', flux.list)
+    except (TypeError, OverflowError):
+        # fractional or huge intervals have to stay as they are
+        return flux
+    return Flux(flux.index_list, intervals, flux.sample_freq)
+
+
+class FluxStreamWriter:
+    """Append flux captures to a flux stream file"""
+    def __init__(self, filename, compresslevel: int=6):
+        self.filename = filename
+        self.file = gzip.open(filename, "wb", compresslevel=compresslevel)
+        self.file.write(MAGIC)
+        self.records = 0
+
+
+    def write(self, cyl: int, pcyl: int, head: int, attempt: int, flux: Flux):
+        self.file.write(RECORD.pack(cyl, pcyl, head, attempt, flux.sample_freq,
+                                    len(flux.index_list), len(flux.list)))
+        self.file.write(_to_bytes(flux.index_list))
+        self.file.write(_to_bytes(flux.list))
+        # a sync flush per capture keeps the stream readable if we die
+        self.file.flush()
+        self.records += 1
+
+
+    def close(self):
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_flux_stream(filename) -> Iterator[FluxRecord]:
+    """Iterate over the records in a flux stream, one capture at a time"""
+    with gzip.open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a flux stream")
+        while True:
+            try:
+                hdr = f.read(RECORD.size)
+            except EOFError:
+                # the stream was cut short mid-record
+                return
+            if len(hdr) < RECORD.size:
+                return
+            cyl, pcyl, head, attempt, sample_freq, nr_index, nr_flux = RECORD.unpack(hdr)
+            try:
+                index_data = f.read(4 * nr_index)
+                flux_data = f.read(4 * nr_flux)
+            except EOFError:
+                return
+            if len(index_data) < 4 * nr_index or len(flux_data) < 4 * nr_flux:
+                # cut off in the middle of the record
+                return
+            index_list = _from_bytes(index_data)
+            flux_list = _from_bytes(flux_data)
+            yield FluxRecord(cyl, pcyl, head, attempt,
+                             Flux(list(index_list), flux_list, sample_freq))
+
+
+def export(stream: str, filename: str, last: bool=True):
+    """Convert a flux stream into one of the greaseweazle flux image formats
+    (scp, hfe, raw, etc).  Only one capture per track can be stored, which is
+    the last attempt unless last is False.
+    """
+    image_class = util.get_image_class(filename)
+    img = image_class.to_file(filename, None, False, {})
+    seen = set()
+    for rec in read_flux_stream(stream):
+        if not last and (rec.pcyl, rec.head) in seen:
+            continue
+        seen.add((rec.pcyl, rec.head))
+        img.emit_track(rec.pcyl, rec.head, rec.flux)
+    with open(filename, "wb") as f:
+        f.write(img.get_image())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a flux stream to a greaseweazle flux image")
+    parser.add_argument("stream", help="Flux stream file")
+    parser.add_argument("image", help="Output image (scp, hfe, raw, ...)")
+    parser.add_argument("--first", default=False, action="store_true", help="Use the first capture of each track instead of the last")
+    args = parser.parse_args()
+    export(args.stream, args.image, last=not args.first)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/bin/env python3
+"""Which tracks of a disk the filesystem is using
+
+For a sparse read, only the tracks that have something on them are
+captured.  A planner for the disk's filesystem is a generator that yields
+the set of (cyl, head) tracks it needs to look at, is sent back a
+dictionary of (cyl, head) -> (complete, track image data) once they've
+been read, and finally returns the set of tracks that are in use, or None
+if the disk can't be mapped (unknown filesystem, unreadable metadata) and
+the whole disk should be read.
+
+The filesystems understood are FAT12 (ibm.*), AmigaDOS (amiga.*) and
+Commodore DOS 1541/1571 (commodore.1541, commodore.1571).  The planners
+only use the DiskDef's geometry and the track data, so nothing here needs
+the greaseweazle.
+"""
+from __future__ import annotations
+import logging
+import math
+import struct
+from typing import TYPE_CHECKING, Generator
+
+if TYPE_CHECKING:
+    from greaseweazle.codec import codec
+
+
+Tracks = set[tuple[int, int]]
+Planner = Generator[Tracks, dict, Tracks | None]
+
+
+def fill_byte(format: str) -> int:
+    """What the tracks that aren't read are filled with:  the byte DOS
+    formats PC disks with, zeros for everything else"""
+    return 0xf6 if format.startswith('ibm.') else 0x00
+
+
+class Unmappable(Exception):
+    "The filesystem metadata isn't there or doesn't make sense"
+
+
+def _track(data: dict, key: tuple[int, int]) -> bytes:
+    complete, track = data.get(key, (False, None))
+    if not complete:
+        raise Unmappable(f"track {key[0]}.{key[1]} wasn't read cleanly")
+    return track
+
+
+def planner(format: str, fmt: codec.DiskDef) -> Planner:
+    """The planner for the format's filesystem"""
+    try:
+        if format.startswith('ibm.'):
+            return (yield from fat12(fmt))
+        if format.startswith('amiga.'):
+            return (yield from amigados(fmt))
+        if format in ('commodore.1541', 'commodore.1571'):
+            return (yield from cbm_dos(fmt))
+    except Unmappable as e:
+        logging.info(f"Cannot map the {format} filesystem, reading the whole disk: {e}")
+    except (struct.error, IndexError, ValueError, ZeroDivisionError) as e:
+        logging.info(f"The {format} filesystem metadata is damaged, reading the whole disk: {e}")
+    return None
+
+
+def fat12(fmt: codec.DiskDef) -> Planner:
+    "The boot sector's BPB, then the FATs and root directory"
+    data = yield {(0, 0)}
+    boot = _track(data, (0, 0))[:512]
+    (bps, spc, reserved, nfats, root_entries, total,
+     media, spf, spt, heads) = struct.unpack_from('<HBHBHHBHHH', boot, 11)
+    if (bps not in (128, 256, 512, 1024) or spc not in (1, 2, 4, 8, 16, 32, 64)
+            or nfats not in (1, 2) or not 0 < spt <= 64 or heads not in (1, 2) or not spf or not total):
+        raise Unmappable("no valid BPB in the boot sector")
+
+    def lba_track(lba: int) -> tuple[int, int]:
+        t = lba // spt
+        return (t // heads, t % heads)
+
+    def sector(lba: int) -> bytes:
+        offset = (lba % spt) * bps
+        return _track(data, lba_track(lba))[offset:offset + bps]
+
+    root_start = reserved + nfats * spf
+    data_start = root_start + math.ceil(root_entries * 32 / bps)
+    clusters = (total - data_start) // spc
+    if clusters >= 4085:
+        raise Unmappable("not FAT12")
+    used = {lba_track(lba) for lba in range(data_start)}
+    data = yield used
+    fat = b''.join(sector(lba) for lba in range(reserved, reserved + spf))
+    for n in range(2, clusters + 2):
+        offset = n * 3 // 2
+        entry = struct.unpack_from('<H', fat, offset)[0]
+        entry = entry >> 4 if n & 1 else entry & 0xfff
+        if entry:
+            first = data_start + (n - 2) * spc
+            used.update(lba_track(lba) for lba in range(first, first + spc))
+    return used
+
+
+def amigados(fmt: codec.DiskDef) -> Planner:
+    "The root block in the middle of the disk, then its bitmap blocks"
+    nsec = fmt.mk_track(0, 0).nsec
+    blocks = fmt.cyls * fmt.heads * nsec
+    root = blocks // 2
+
+    def block_track(b: int) -> tuple[int, int]:
+        t = b // nsec
+        return (t // fmt.heads, t % fmt.heads)
+
+    def block(b: int) -> bytes:
+        offset = (b % nsec) * 512
+        return _track(data, block_track(b))[offset:offset + 512]
+
+    data = yield {block_track(root)}
+    rootblk = block(root)
+    if struct.unpack_from('>I', rootblk, 0)[0] != 2 or struct.unpack_from('>i', rootblk, 508)[0] != 1:
+        raise Unmappable("no root block")
+    if struct.unpack_from('>i', rootblk, 312)[0] != -1:
+        raise Unmappable("the bitmap isn't valid")
+    pages = [p for p in struct.unpack_from('>25I', rootblk, 316) if p]
+    if not pages or any(p >= blocks for p in pages):
+        raise Unmappable("no bitmap blocks")
+    data = yield {block_track(p) for p in pages}
+
+    # the boot blocks, the root and the bitmap are always in use.  Each
+    # bitmap block has a bit for each block from 2 up, set when it's free
+    used = {block_track(b) for b in (0, 1, root, *pages)}
+    per_page = 127 * 32
+    for i, p in enumerate(pages):
+        bits = struct.unpack_from('>127I', block(p), 4)
+        for n in range(per_page):
+            b = 2 + i * per_page + n
+            if b >= blocks:
+                break
+            if not (bits[n // 32] >> (n % 32)) & 1:
+                used.add(block_track(b))
+    return used
+
+
+def cbm_dos(fmt: codec.DiskDef) -> Planner:
+    "The BAM on track 18 (and its free counts for the second side of a 1571)"
+    data = yield {(17, 0)}
+    bam = _track(data, (17, 0))[:256]
+    if bam[2] != 0x41:
+        raise Unmappable("no BAM on track 18")
+    used = {(17, 0)}
+    for t in range(1, min(35, fmt.cyls) + 1):
+        if bam[4 * t] < fmt.mk_track(t - 1, 0).nsec:
+            used.add((t - 1, 0))
+    if fmt.heads > 1 and bam[3] & 0x80:
+        # double sided: the second side's BAM is on track 53
+        used.add((17, 1))
+        for t in range(36, 36 + min(35, fmt.cyls)):
+            if bam[0xdd + t - 36] < fmt.mk_track(t - 36, 1).nsec:
+                used.add((t - 36, 1))
+    return used
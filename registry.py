@@ -0,0 +1,121 @@
+#!/bin/env python3
+"""Cached format and image type tables
+
+Finding the formats the greaseweazle supports means parsing all of its
+diskdefs, and every get_diskdef() call parses them again.  The registry
+does that work once: the format list, the image extension table and the
+validated configuration are kept in a cache file, keyed by the
+configuration file's modification time and the greaseweazle version, and
+disk definitions are only parsed the first time each one is used.
+"""
+from importlib import metadata
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from greaseweazle.tools import util
+from greaseweazle.codec import codec
+from greaseweazle.codec.codec import DiskDef_File
+
+
+CACHE_FILE = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'), 'FloppyDiskReader', 'registry.json')
+
+
+def greaseweazle_version() -> str:
+    try:
+        return metadata.version('greaseweazle')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+class FormatRegistry:
+    def __init__(self, cache_file: Path=CACHE_FILE):
+        self.cache_file = Path(cache_file)
+        self.version = greaseweazle_version()
+        self._lock = threading.Lock()
+        self._diskdefs: dict[str, codec.DiskDef] = {}
+        self._cache = None
+
+
+    @property
+    def cache(self) -> dict:
+        if self._cache is None:
+            try:
+                with open(self.cache_file) as f:
+                    self._cache = json.load(f)
+                if self._cache.get('version') != self.version:
+                    self._cache = None
+            except (OSError, ValueError):
+                pass
+            if self._cache is None:
+                self._cache = {'version': self.version, 'configs': {}}
+        return self._cache
+
+
+    def _save(self):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_file.with_suffix('.tmp')
+            with open(tmp, "w") as f:
+                json.dump(self.cache, f)
+            tmp.replace(self.cache_file)
+        except OSError as e:
+            logging.debug(f"Cannot write the format cache {self.cache_file}: {e}")
+
+
+    def all_formats(self) -> list[str]:
+        """All of the format names the greaseweazle supports"""
+        with self._lock:
+            if 'formats' not in self.cache:
+                self.cache['formats'] = list(codec.get_all_formats('', DiskDef_File(None)))
+                self._save()
+            return self.cache['formats']
+
+
+    def extensions(self) -> dict[str, str]:
+        """The image file extension for each format that has its own image type"""
+        with self._lock:
+            if 'extensions' not in self.cache:
+                extensions = {}
+                for suffix in util.image_types:
+                    iclass = util.get_image_class('x' + suffix)
+                    if iclass.default_format:
+                        extensions[iclass.default_format] = suffix
+                self.cache['extensions'] = extensions
+                self._save()
+            return self.cache['extensions']
+
+
+    def get_diskdef(self, name: str) -> codec.DiskDef:
+        """The disk definition for a format, parsed the first time it's used"""
+        with self._lock:
+            if name not in self._diskdefs:
+                self._diskdefs[name] = codec.get_diskdef(name)
+            return self._diskdefs[name]
+
+
+    def _config_key(self, filename) -> tuple[str, list]:
+        st = os.stat(filename)
+        return str(Path(filename).resolve()), [st.st_mtime_ns, st.st_size]
+
+
+    def cached_config(self, filename) -> dict | None:
+        """The validated configuration from the cache, if the file hasn't
+        changed since it was stored"""
+        path, stamp = self._config_key(filename)
+        with self._lock:
+            entry = self.cache['configs'].get(path)
+            if entry and entry['stamp'] == stamp:
+                return entry['config']
+        return None
+
+
+    def store_config(self, filename, config: dict):
+        path, stamp = self._config_key(filename)
+        with self._lock:
+            self.cache['configs'][path] = {'stamp': stamp, 'config': config}
+            self._save()
+
+
+registry = FormatRegistry()
@@ -0,0 +1,122 @@
+#!/bin/env python3
+"""Run jobs on several greaseweazles at the same time
+
+Each greaseweazle gets its own worker thread and jobs for its drives are
+queued on it, so every unit is kept busy with its own disk while jobs for
+the same unit run one after another.  Each job keeps its own progress
+callback, which is called from that unit's worker thread.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import itertools
+import logging
+import threading
+import time
+from typing import Callable
+from floppy import FloppyReader
+
+
+@dataclass
+class Job:
+    id: int
+    operation: str
+    drive: str
+    unit: str
+    args: tuple
+    kwargs: dict
+    status: str = 'queued'
+    submitted: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    future: Future | None = None
+
+
+class UnitScheduler:
+    """Queue probe, read_image, verify_image and rpm jobs on the greaseweazle
+    that owns the job's drive.
+    """
+    operations = ('probe', 'read_image', 'verify_image', 'rpm')
+
+    def __init__(self, reader: FloppyReader):
+        self.reader = reader
+        self.executors = {unit: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"greaseweazle-{unit}")
+                          for unit in reader.units}
+        self.jobs: dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+
+    def submit(self, operation: str, drive: str, *args, **kwargs) -> Job:
+        """Queue an operation on the drive's greaseweazle.  The arguments
+        are the same as the FloppyReader method of the same name, including
+        the callback for probe, read_image and verify_image.
+        """
+        if operation not in self.operations:
+            raise ValueError(f"Operation must be one of: {list(self.operations)}")
+        if drive not in self.reader.drives:
+            raise KeyError("This drive is not configured")
+        unit = self.reader.drives[drive]['unit']
+        with self._lock:
+            job = Job(next(self._ids), operation, drive, unit, args, kwargs)
+            self.jobs[job.id] = job
+        job.future = self.executors[unit].submit(self._run, job)
+        job.future.add_done_callback(lambda future: self._dropped(job))
+        return job
+
+
+    def _dropped(self, job: Job):
+        # a job cancelled before it started never gets to _run
+        if job.future.cancelled():
+            job.status = 'cancelled'
+            job.finished = time.time()
+
+
+    def forget(self, job: Job):
+        """Stop keeping a finished job"""
+        with self._lock:
+            self.jobs.pop(job.id, None)
+
+
+    def _run(self, job: Job):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            res = getattr(self.reader, job.operation)(job.drive, *job.args, **job.kwargs)
+            job.status = 'done'
+            return res
+        except Exception as e:
+            logging.exception(f"Job {job.id} ({job.operation} on {job.drive}) failed: {e}")
+            job.status = 'failed'
+            raise
+        finally:
+            job.finished = time.time()
+
+
+    def probe(self, drive: str, callback: Callable=None) -> Job:
+        return self.submit('probe', drive, callback=callback)
+
+
+    def read_image(self, drive: str, format: str, filename: str, **kwargs) -> Job:
+        return self.submit('read_image', drive, format, filename, **kwargs)
+
+
+    def wait(self, jobs: list[Job]=None):
+        """Wait for the jobs (or everything that's been submitted) to finish"""
+        for job in jobs if jobs is not None else list(self.jobs.values()):
+            try:
+                job.future.result()
+            except Exception:
+                pass
+
+
+    def shutdown(self, wait: bool=True):
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.shutdown()
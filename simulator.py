@@ -0,0 +1,206 @@
+#!/bin/env python3
+"""Simulated greaseweazle for running without hardware
+
+SimulatedUnit stands in for greaseweazle.usb.Unit and serves flux from a
+file instead of a drive:  either a flux stream recorded by read_image or a
+sector image (such as the ones in sample_floppies) that has flux
+synthesized from it a track at a time.
+
+Seeking, spinning up and each revolution take the time they would on a
+real drive, so throughput changes can be measured without the hardware.
+The disk can be taken out and another one put in with eject() and
+insert(), and the disk change line (pin 34) behaves the way a PC drive's
+does.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import logging
+from pathlib import Path
+import time
+from greaseweazle.tools import util
+from greaseweazle import error
+from greaseweazle.flux import Flux
+from greaseweazle.codec import codec
+from greaseweazle.image import image
+import fluxstream
+from registry import registry
+
+
+PORT_PREFIX = "sim:"
+DISK_CHANGE_PIN = 34
+# the greaseweazle's ReadFlux command and its No Index error code
+CMD_READ_FLUX = 7
+ACK_NO_INDEX = 2
+
+
+def open_image(filename, fmt: codec.DiskDef) -> image.Image:
+    """Load an existing sector image with the greaseweazle image classes"""
+    image_class = util.get_image_class(str(filename))
+    return image_class.from_file(str(filename), fmt, {})
+
+
+def format_for_image(filename) -> str:
+    """Guess the greaseweazle format of an image, using the image's default
+    format if it has one or the sample_floppies naming convention
+    (commodore_1541.d64 -> commodore.1541) otherwise.
+    """
+    filename = Path(filename)
+    image_class = util.get_image_class(str(filename))
+    if image_class.default_format:
+        return image_class.default_format
+    parts = filename.stem.split('_')
+    return '.'.join(parts[:2])
+
+
+def first_revolution(flux: Flux) -> tuple[int, array]:
+    """Returns the length of the first revolution and its flux intervals"""
+    rev = flux.index_list[0]
+    times = list(accumulate(flux.list))
+    end = min(bisect_left(times, rev) + 1, len(times))
+    return rev, array('I', flux.list[:end])
+
+
+class SimulatedUnit:
+    """Serve recorded or synthesized flux through the usb.Unit interface
+    that FloppyReader uses.
+
+    drives maps (bus type, unit id) to the number of tracks of the drive so
+    40 track formats can be double-stepped the way read_image expects.
+    """
+    sample_freq = 72_000_000
+
+    def __init__(self, path, format: str=None, drives: dict=None,
+                 rpm: float=300, seek_ms: float=3, settle_ms: float=15,
+                 spinup_ms: float=500, realtime: bool=True):
+        self.drives = drives or {}
+        self.rev_time = 60 / rpm
+        self.seek_time = seek_ms / 1000
+        self.settle_time = settle_ms / 1000
+        self.spinup_time = spinup_ms / 1000
+        self.realtime = realtime
+        self.bus_type = None
+        self.unit_id = None
+        self.motor = False
+        self.cyl = 0
+        self.head = 0
+        # the disk change line is active from power on until the first step
+        self.changed = True
+        self.insert(path, format)
+
+
+    def insert(self, path, format: str=None):
+        """Put a disk in the drive, either a flux stream or a sector image"""
+        self.path = Path(path)
+        self.fmt: codec.DiskDef = None
+        self.img: image.Image = None
+        # (physical cyl, head) -> list of (revolution length, intervals)
+        self.revolutions: dict[tuple[int, int], list[tuple[int, array]]] = {}
+        self.reads: dict[tuple[int, int], int] = {}
+        self.sample_rates: dict[tuple[int, int], float] = {}
+        self.disk_in = True
+
+        if self.path.name.endswith(fluxstream.SUFFIX):
+            for rec in fluxstream.read_flux_stream(self.path):
+                key = (rec.pcyl, rec.head)
+                self.revolutions.setdefault(key, []).append(first_revolution(rec.flux))
+                self.sample_rates[key] = rec.flux.sample_freq
+            logging.info(f"Simulating {len(self.revolutions)} recorded tracks from {self.path}")
+        else:
+            format = format or format_for_image(self.path)
+            self.fmt = registry.get_diskdef(format)
+            self.img = open_image(self.path, self.fmt)
+            logging.info(f"Simulating {format} from {self.path}")
+
+
+    def eject(self):
+        """Take the disk out of the drive"""
+        self.disk_in = False
+        self.changed = True
+
+
+    def _wait(self, seconds: float):
+        if self.realtime and seconds > 0:
+            time.sleep(seconds)
+
+
+    def _track(self, pcyl: int, head: int):
+        key = (pcyl, head)
+        if key not in self.revolutions and self.img is not None:
+            # synthesize it from the sector image the first time it's read
+            tracks = self.drives.get((self.bus_type, self.unit_id), self.fmt.cyls)
+            step = 2 if tracks > self.fmt.cyls else 1
+            trk = None
+            if pcyl % step == 0 and pcyl // step < self.fmt.cyls:
+                trk = self.img.get_track(pcyl // step, head)
+            if trk is not None:
+                flux = trk.flux()
+                self.revolutions[key] = [first_revolution(flux)]
+                self.sample_rates[key] = flux.sample_freq
+            else:
+                self.revolutions[key] = []
+        return self.revolutions.get(key, [])
+
+
+    def set_bus_type(self, bus_type):
+        self.bus_type = bus_type
+
+
+    def drive_select(self, unit_id: int):
+        self.unit_id = unit_id
+
+
+    def drive_deselect(self):
+        self.unit_id = None
+
+
+    def drive_motor(self, unit_id: int, state: bool):
+        if state and not self.motor:
+            self._wait(self.spinup_time)
+        self.motor = state
+
+
+    def get_pin(self, pin: int) -> bool:
+        if pin == DISK_CHANGE_PIN:
+            # low when there's no disk or it hasn't been stepped since it was put in
+            return self.disk_in and not self.changed
+        return True
+
+
+    def seek(self, cyl: int, head: int):
+        if cyl != self.cyl:
+            self._wait(abs(cyl - self.cyl) * self.seek_time + self.settle_time)
+            if self.disk_in:
+                self.changed = False
+        self.cyl = cyl
+        self.head = head
+
+
+    def read_track(self, revs: int, ticks: int=0, nr_retries: int=5) -> Flux:
+        if not self.disk_in:
+            raise error.CmdError(CMD_READ_FLUX, ACK_NO_INDEX)
+        revolutions = self._track(self.cyl, self.head)
+        # ticks (of the unit's sample clock) stops the capture before the
+        # last index pulse, like the real thing
+        length = min(revs, ticks / (self.rev_time * self.sample_freq)) if ticks else revs
+        # wait for the index, on average half a revolution, and then the capture
+        self._wait(self.rev_time * (0.5 + length))
+        if not revolutions:
+            # unformatted track: no flux transitions, just the index
+            rev = int(self.rev_time * self.sample_freq)
+            return Flux([rev] * int(length), [rev] * int(length), self.sample_freq)
+        # recorded tracks hand out each capture in turn, like a retry would
+        key = (self.cyl, self.head)
+        n = self.reads.get(key, 0)
+        self.reads[key] = n + 1
+        rev, intervals = revolutions[n % len(revolutions)]
+        intervals = intervals * revs
+        if length < revs:
+            end = rev * length
+            intervals = intervals[:bisect_right(list(accumulate(intervals)), end)]
+        return Flux([rev] * int(length), intervals, self.sample_rates[key])
+
+
+    def reset(self):
+        self.motor = False
+        self.unit_id = None
@@ -0,0 +1,120 @@
+#!/bin/env python3
+"""Per-track timing records for reads and probes
+
+While a disk is read, a JSON Lines file next to the image gets a record
+for every finished track with how long was spent seeking, capturing and
+decoding it, how many revolutions were captured, how many sectors were
+found and how many retries it took.  When the read ends the totals for
+the session are written next to the image as JSON, so slow drives and bad
+media can be spotted across a whole collection.
+"""
+import json
+import logging
+from pathlib import Path
+import time
+
+
+TELEMETRY_SUFFIX = '.telemetry.jsonl'
+SUMMARY_SUFFIX = '.summary.json'
+
+
+def telemetry_file(filename) -> Path:
+    filename = Path(filename)
+    return filename.parent / (filename.name + TELEMETRY_SUFFIX)
+
+
+def summary_file(filename) -> Path:
+    filename = Path(filename)
+    return filename.parent / (filename.name + SUMMARY_SUFFIX)
+
+
+def load_summary(filename) -> dict | None:
+    """The session summary written for an image, if there is one"""
+    try:
+        with open(summary_file(filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Telemetry:
+    """Collects the records for one session, writing them to filename (if
+    given) as they come in and keeping the totals.
+    """
+    PHASES = ('seek', 'capture', 'decode')
+
+    def __init__(self, filename=None, append: bool=False, **session):
+        self.file = open(filename, "a" if append else "w", buffering=1 << 16) if filename else None
+        self.session = session
+        self.started = time.time()
+        self.tracks = 0
+        self.restored = 0
+        self.skipped = 0
+        self.bad_tracks = 0
+        self.captures = 0
+        self.revs = 0
+        self.bytes = 0
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+
+
+    def record(self, kind: str, **values):
+        "Write a record of any kind"
+        if self.file:
+            self.file.write(json.dumps({'kind': kind, 'time': round(time.time(), 3), **values}) + "\n")
+
+
+    def track(self, cyl: int, head: int, seek: float=0, capture: float=0, decode: float=0,
+              revs: int=0, captures: int=0, sectors: int=0, nsec: int=0, bytes: int=0,
+              restored: bool=False, skipped: bool=False):
+        "Record a finished track"
+        self.tracks += 1
+        self.restored += restored
+        self.skipped += skipped
+        self.bad_tracks += sectors < nsec
+        self.captures += captures
+        self.revs += revs
+        self.bytes += bytes
+        for phase, t in zip(self.PHASES, (seek, capture, decode)):
+            self.phases[phase] += t
+        self.record('track', cyl=cyl, head=head, seek=round(seek, 4), capture=round(capture, 4),
+                    decode=round(decode, 4), revs=revs, retries=max(0, captures - 1),
+                    sectors=sectors, nsec=nsec, bytes=bytes, restored=restored, skipped=skipped)
+
+
+    def summary(self, **extra) -> dict:
+        "The totals for the session so far"
+        elapsed = time.time() - self.started
+        read = self.tracks - self.restored - self.skipped
+        retries = self.captures - read
+        return {**self.session,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'elapsed': round(elapsed, 3),
+                'tracks': self.tracks,
+                'restored': self.restored,
+                'skipped': self.skipped,
+                'bad_tracks': self.bad_tracks,
+                'captures': self.captures,
+                'retries': retries,
+                'retry_ratio': round(retries / read, 3) if read else 0,
+                'revs': self.revs,
+                'bytes': self.bytes,
+                'tracks_per_s': round(read / elapsed, 3) if elapsed else 0,
+                'phases': {phase: round(t, 3) for phase, t in self.phases.items()},
+                **extra}
+
+
+    def close(self, summary_filename=None, **extra) -> dict:
+        """Finish the session, writing the summary to summary_filename if
+        it's given.  Returns the summary."""
+        summary = self.summary(**extra)
+        self.record('summary', **summary)
+        if self.file:
+            self.file.close()
+            self.file = None
+        if summary_filename:
+            try:
+                with open(summary_filename, "w") as f:
+                    json.dump(summary, f, indent=2)
+            except OSError as e:
+                logging.warning(f"Cannot write the read summary {summary_filename}: {e}")
+        return summary
@@ -0,0 +1,109 @@
+from importlib import metadata
+import os
+from pathlib import Path
+import sys
+import tempfile
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+SAMPLES = ROOT / "sample_floppies"
+
+sys.path.insert(0, str(ROOT))
+# keep the fingerprint index, catalog and config cache out of the user's home
+_home = tempfile.mkdtemp(prefix="FloppyDiskReader-tests-")
+os.environ['XDG_DATA_HOME'] = str(Path(_home, "data"))
+os.environ['XDG_CACHE_HOME'] = str(Path(_home, "cache"))
+
+
+def pytest_report_header(config):
+    try:
+        return f"greaseweazle {metadata.version('greaseweazle')}"
+    except metadata.PackageNotFoundError:
+        return "greaseweazle is not installed, the tests that need it are skipped"
+
+
+class Geometry:
+    """Stands in for a format's DiskDef where only the geometry is used"""
+    class Track:
+        def __init__(self, nsec: int):
+            self.nsec = nsec
+
+    def __init__(self, cyls: int, heads: int, sectors):
+        self.cyls = cyls
+        self.heads = heads
+        # the sectors on each cylinder
+        self.sectors = sectors
+
+    def mk_track(self, cyl: int, head: int) -> Track:
+        return self.Track(self.sectors(cyl))
+
+
+def c64_sectors(cyl: int) -> int:
+    return 21 if cyl < 17 else 19 if cyl < 24 else 18 if cyl < 30 else 17
+
+
+# format: geometry, sector size
+GEOMETRY = {
+    'ibm.360': (Geometry(40, 2, lambda c: 9), 512),
+    'ibm.720': (Geometry(80, 2, lambda c: 9), 512),
+    'ibm.1200': (Geometry(80, 2, lambda c: 15), 512),
+    'ibm.1440': (Geometry(80, 2, lambda c: 18), 512),
+    'amiga.amigados': (Geometry(80, 2, lambda c: 11), 512),
+    # zoned: 12 sectors on the outer 16 cylinders, one less for each 16 after
+    'mac.800': (Geometry(80, 2, lambda c: 12 - c // 16), 512),
+    # zoned, and the second side of a 1571 follows the whole first side
+    'commodore.1541': (Geometry(35, 1, c64_sectors), 256),
+    'commodore.1571': (Geometry(35, 2, c64_sectors), 256),
+}
+
+
+def raw_tracks(image: str, format: str) -> tuple[Geometry, dict[tuple[int, int], bytes]]:
+    """Split a sample sector image into its tracks, without the greaseweazle"""
+    geometry, size = GEOMETRY[format]
+    data = (SAMPLES / image).read_bytes()
+    order = [(c, h) for c in range(geometry.cyls) for h in range(geometry.heads)]
+    if format.startswith('commodore.'):
+        order = [(c, h) for h in range(geometry.heads) for c in range(geometry.cyls)]
+    tracks = {}
+    offset = 0
+    for c, h in order:
+        length = geometry.sectors(c) * size
+        tracks[(c, h)] = data[offset:offset + length]
+        offset += length
+    assert offset == len(data), f"{image} isn't laid out as {format}"
+    return geometry, tracks
+
+
+CONFIG = """
+greaseweazle:
+  port: "sim:{image}"
+  motor_idle: 0
+  simulation:
+    format: {format}
+    realtime: false
+  drives:
+    a: {drive}
+formats:
+  {drive}:
+    - {format}
+"""
+
+
+@pytest.fixture
+def make_reader(tmp_path):
+    """Make a FloppyReader with drive A on a simulated greaseweazle serving
+    the image (or flux stream) without any of the drive delays"""
+    from floppy import FloppyReader
+    readers = []
+
+    def make(image, format: str, drive: str='3.5HD'):
+        config = tmp_path / f"reader{len(readers)}.conf"
+        config.write_text(CONFIG.format(image=image, format=format, drive=drive))
+        reader = FloppyReader(config)
+        readers.append(reader)
+        return reader
+
+    yield make
+    for reader in readers:
+        reader.close()
@@ -0,0 +1,49 @@
+"""The catalog database, with the images loaded by the greaseweazle"""
+import pytest
+
+pytest.importorskip("greaseweazle")
+
+import catalog
+from conftest import SAMPLES, raw_tracks
+from registry import registry
+from test_filesystems import EXPECTED
+
+
+def load(image: str, format: str):
+    fmt = registry.get_diskdef(format)
+    return fmt, catalog.image_tracks(SAMPLES / image, fmt)
+
+
+@pytest.mark.parametrize("image, format", list(EXPECTED))
+def test_image_tracks(image, format):
+    # the greaseweazle's tracks are the same bytes the parser tests use
+    _, tracks = load(image, format)
+    _, raw = raw_tracks(image, format)
+    assert tracks == raw
+
+
+def test_catalog(tmp_path):
+    db = catalog.Catalog(tmp_path / "catalog.db")
+    try:
+        for image, format in (("ibm_1440.img", "ibm.1440"), ("ibm_720.img", "ibm.720"),
+                              ("commodore_1541.d64", "commodore.1541")):
+            fmt, tracks = load(image, format)
+            assert db.add(SAMPLES / image, format, fmt, tracks) == 1
+        # adding an image again replaces its files
+        fmt, tracks = load("ibm_720.img", "ibm.720")
+        assert db.add(SAMPLES / "ibm_720.img", "ibm.720", fmt, tracks) == 1
+
+        rows = db.search("readme.txt")
+        assert [(r['image'], r['path']) for r in rows] == [
+            (str((SAMPLES / "ibm_1440.img").absolute()), "README.TXT"),
+            (str((SAMPLES / "ibm_720.img").absolute()), "README.TXT")]
+        assert [r['path'] for r in db.search("SAMPLE.*")] == ["SAMPLE.BAS"]
+        assert [r['path'] for r in db.search("?EADME.TX?")] == ["README.TXT", "README.TXT"]
+        assert db.search("README_TXT") == []
+
+        digest = EXPECTED[("commodore_1541.d64", "commodore.1541")][2][0][4]
+        rows = db.find_hash(digest.upper())
+        assert [(r['image'], r['kind'], r['size']) for r in rows] == [
+            (str((SAMPLES / "commodore_1541.d64").absolute()), "PRG", 47)]
+    finally:
+        db.close()
@@ -0,0 +1,75 @@
+"""The filesystem parsers, on the sample images"""
+from datetime import datetime
+
+import pytest
+
+from conftest import SAMPLES, raw_tracks
+import filesystems
+
+
+# image, format: filesystem, volume, [(path, size, modified, kind, sha256)]
+EXPECTED = {
+    ("ibm_1440.img", "ibm.1440"): ("fat12", None, [
+        ("README.TXT", 12, datetime(2025, 4, 30, 13, 28, 38), None,
+         "861cf8cd7c3a26870de60ff3e99acc267ada0962a75b13f64c81f047d0e7265d")]),
+    ("ibm_720.img", "ibm.720"): ("fat12", None, [
+        ("README.TXT", 11, datetime(2025, 4, 30, 13, 28, 28), None,
+         "d29fd1d3e9e0ad80b0eba38701ae2179a705e02ec0f57ba538d663e936eb9fd1")]),
+    ("ibm_360.img", "ibm.360"): ("fat12", None, [
+        ("README.TXT", 11, datetime(2025, 4, 30, 13, 28, 4), None,
+         "e6d28afec704db69006852a7648d7c4711c07dd54392538d7a1669e824f0e0bd")]),
+    ("ibm_1200.img", "ibm.1200"): ("fat12", None, [
+        ("README.TXT", 11, datetime(2025, 4, 30, 13, 28, 48), None,
+         "3f07db16b67576eecd551163d469772e2175802b173e5431241687c48369d29e")]),
+    # an HFS volume on a PC formatted disk
+    ("ibm_1440_mac.img", "ibm.1440"): ("mac", "Test disk", [
+        ("Readme.txt", 30, datetime(2025, 5, 1, 10, 52, 32), "????/UNIX",
+         "2ff50bb90f4fe3bbc0995d734ae3439132afaceeb1d244d09f30ddc3410e35d4")]),
+    ("mac_800.img", "mac.800"): ("mac", "Test Disk", []),
+    ("amiga_amigados.adf", "amiga.amigados"): ("amigados", "Empty", [
+        ("Readme.txt.info", 454, datetime(2025, 4, 30, 14, 20, 30, 140000), None,
+         "bdbf9d5f99e80f54a0fe3a409883fb5291e21d589538a18dac5e1f3f041df23e"),
+        ("Readme.txt", 25, datetime(2025, 4, 30, 14, 20, 30, 20000), None,
+         "4a0cbab217f261a448fa0160c3b5f72fc4a8bc89a4dfe603b71006b8ca82b16c"),
+        ("Trashcan.info", 430, datetime(2025, 4, 30, 14, 19, 50, 660000), None,
+         "76c2de19866d642e526972401d93536610129592e897db855aacb200b0001e5e")]),
+    ("commodore_1541.d64", "commodore.1541"): ("cbm_dos", "TEST DISK", [
+        ("SAMPLE.BAS", 47, None, "PRG",
+         "3bc4bbc22fcffbb999dabe79e110b59b92b422887214f3d47e6918193a352523")]),
+    ("commodore_1571.d71", "commodore.1571"): ("cbm_dos", "TEST DISK", [
+        ("SAMPLE.BAS", 106, None, "PRG",
+         "56230bcb2bd105449fc3a37d144768552ea590cb97422608d9bd2ed5e52f375c")]),
+}
+
+
+@pytest.mark.parametrize("image, format", list(EXPECTED))
+def test_list_files(image, format):
+    fmt, tracks = raw_tracks(image, format)
+    filesystem, volume, files = filesystems.list_files(format, fmt, tracks)
+    assert (filesystem, volume) == EXPECTED[(image, format)][:2]
+    assert [(f.path, f.size, f.modified, f.kind, f.sha256) for f in files] == EXPECTED[(image, format)][2]
+
+
+def test_missing_track():
+    fmt, tracks = raw_tracks("ibm_1440.img", "ibm.1440")
+    del tracks[(40, 1)]
+    with pytest.raises(filesystems.Uncataloged):
+        filesystems.fat12(fmt, tracks)
+
+
+def test_no_filesystem():
+    fmt, tracks = raw_tracks("ibm_1440.img", "ibm.1440")
+    tracks[(0, 0)] = bytes(len(tracks[(0, 0)]))
+    assert filesystems.list_files("ibm.1440", fmt, tracks) is None
+
+
+def test_damaged_directory():
+    # a directory chain that loops back on itself is only walked once
+    fmt, tracks = raw_tracks("commodore_1541.d64", "commodore.1541")
+    bam = bytearray(tracks[(17, 0)])
+    directory = bam[0], bam[1]
+    sector = 256 * directory[1]
+    bam[sector:sector + 2] = bytes(directory)
+    tracks[(17, 0)] = bytes(bam)
+    volume, files = filesystems.cbm_dos(fmt, tracks)
+    assert [f.path for f in files] == ["SAMPLE.BAS"]
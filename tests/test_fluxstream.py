@@ -0,0 +1,60 @@
+"""Writing and reading back flux streams"""
+from array import array
+import gzip
+
+import pytest
+
+pytest.importorskip("greaseweazle")
+
+from greaseweazle.flux import Flux
+import fluxstream
+
+
+def captures():
+    yield 0, 0, 0, 0, Flux([400000, 400010], [72, 144, 108] * 1000, 72_000_000)
+    yield 0, 0, 1, 0, Flux([399990], array('I', [96, 144] * 500), 72_000_000)
+    yield 1, 2, 0, 1, Flux([], [], 72_000_000)
+
+
+def test_round_trip(tmp_path):
+    stream = tmp_path / f"disk.img{fluxstream.SUFFIX}"
+    with fluxstream.FluxStreamWriter(stream) as writer:
+        for cyl, pcyl, head, attempt, flux in captures():
+            writer.write(cyl, pcyl, head, attempt, flux)
+    assert writer.records == 3
+
+    records = list(fluxstream.read_flux_stream(stream))
+    assert len(records) == 3
+    for rec, (cyl, pcyl, head, attempt, flux) in zip(records, captures()):
+        assert (rec.cyl, rec.pcyl, rec.head, rec.attempt) == (cyl, pcyl, head, attempt)
+        assert list(rec.flux.index_list) == list(flux.index_list)
+        assert list(rec.flux.list) == list(flux.list)
+        assert rec.flux.sample_freq == flux.sample_freq
+
+
+def test_truncated_stream(tmp_path):
+    stream = tmp_path / f"disk.img{fluxstream.SUFFIX}"
+    with fluxstream.FluxStreamWriter(stream) as writer:
+        for capture in captures():
+            writer.write(*capture)
+    data = gzip.decompress(stream.read_bytes())
+    # cut off in the middle of the second record
+    stream.write_bytes(gzip.compress(data[:len(data) - 2000]))
+    assert len(list(fluxstream.read_flux_stream(stream))) == 1
+
+
+def test_not_a_stream(tmp_path):
+    stream = tmp_path / f"disk.img{fluxstream.SUFFIX}"
+    stream.write_bytes(gzip.compress(b"something else"))
+    with pytest.raises(ValueError):
+        list(fluxstream.read_flux_stream(stream))
+
+
+def test_compact():
+    flux = Flux([400000], [72, 144, 108] * 10, 72_000_000)
+    small = fluxstream.compact(flux)
+    assert isinstance(small.list, array) and small.list.typecode == 'I'
+    assert list(small.list) == list(flux.list)
+    # fractional intervals can't be packed, so they're left alone
+    odd = Flux([400000], [72.5, 144.25], 72_000_000)
+    assert fluxstream.compact(odd) is odd
@@ -0,0 +1,57 @@
+"""The sparse read planners, on the sample images"""
+import pytest
+
+from conftest import raw_tracks
+import fsmap
+
+
+def plan(image: str, format: str, broken: set=(), tracks: dict=None):
+    """Run the format's planner, answering with the image's tracks.
+    Returns the tracks it asked for and the tracks it says are in use."""
+    fmt, raw = raw_tracks(image, format)
+    tracks = tracks or raw
+    planner = fsmap.planner(format, fmt)
+    asked = []
+    data = None
+    try:
+        while True:
+            wanted = planner.send(data)
+            asked.append(wanted)
+            data = {t: (t not in broken, tracks[t]) for t in wanted}
+    except StopIteration as e:
+        return asked, e.value
+
+
+@pytest.mark.parametrize("image, format, used", [
+    ("ibm_1440.img", "ibm.1440", {(0, 0), (0, 1)}),
+    ("ibm_720.img", "ibm.720", {(0, 0), (0, 1)}),
+    ("ibm_360.img", "ibm.360", {(0, 0), (0, 1)}),
+    ("ibm_1200.img", "ibm.1200", {(0, 0), (0, 1)}),
+    ("amiga_amigados.adf", "amiga.amigados", {(0, 0), (40, 0)}),
+    ("commodore_1541.d64", "commodore.1541", {(16, 0), (17, 0)}),
+    ("commodore_1571.d71", "commodore.1571", {(16, 0), (17, 0), (17, 1)}),
+])
+def test_used_tracks(image, format, used):
+    asked, result = plan(image, format)
+    assert result == used
+    # the metadata it read is always among the tracks in use
+    assert set().union(*asked) <= used
+
+
+def test_requests():
+    # the boot sector, then the FATs and root directory
+    assert plan("ibm_1440.img", "ibm.1440")[0] == [{(0, 0)}, {(0, 0), (0, 1)}]
+    # the root block, then the bitmap next to it
+    assert plan("amiga_amigados.adf", "amiga.amigados")[0] == [{(40, 0)}, {(40, 0)}]
+    # just the BAM
+    assert plan("commodore_1541.d64", "commodore.1541")[0] == [{(17, 0)}]
+
+
+def test_unmappable():
+    # no planner for Mac disks, so the whole disk is read
+    assert plan("mac_800.img", "mac.800") == ([], None)
+    # nor when the metadata didn't read cleanly
+    assert plan("ibm_1440.img", "ibm.1440", broken={(0, 0)})[1] is None
+    _, tracks = raw_tracks("ibm_1440.img", "ibm.1440")
+    tracks[(0, 0)] = bytes(len(tracks[(0, 0)]))
+    assert plan("ibm_1440.img", "ibm.1440", tracks=tracks)[1] is None
@@ -0,0 +1,99 @@
+"""read_image against a simulated greaseweazle serving the sample images"""
+import pytest
+
+pytest.importorskip("greaseweazle")
+
+from checkpoint import checkpoint_file
+from conftest import SAMPLES
+
+READ = dict(telemetry=False, manifest=False, catalog=False)
+
+
+@pytest.mark.parametrize("image, format, drive", [
+    ("ibm_1440.img", "ibm.1440", "3.5HD"),
+    ("ibm_360.img", "ibm.360", "5.25HD"),
+    ("amiga_amigados.adf", "amiga.amigados", "3.5DD"),
+])
+def test_pipelined_matches_sequential(make_reader, tmp_path, image, format, drive):
+    reader = make_reader(SAMPLES / image, format, drive)
+    outputs = {}
+    messages = {}
+    for pipelined in (False, True):
+        out = tmp_path / f"{pipelined}{reader.get_extension_for_format(format)}"
+        seen = []
+        assert reader.read_image('A', format, out, pipelined=pipelined,
+                                 callback=lambda m: seen.append((m['logical_cylinder'], m['head'], m['success'])) and False,
+                                 **READ)
+        outputs[pipelined] = out.read_bytes()
+        messages[pipelined] = seen
+    assert outputs[True] == outputs[False]
+    # the callbacks come out in the same order either way
+    assert messages[True] == messages[False]
+    assert all(success for _, _, success in messages[False])
+    if image.endswith(".img"):
+        # a raw sector image is written back exactly as it was
+        assert outputs[False] == (SAMPLES / image).read_bytes()
+
+
+def test_resume_from_checkpoint(make_reader, tmp_path):
+    reader = make_reader(SAMPLES / "ibm_1440.img", "ibm.1440")
+    out = tmp_path / "disk.img"
+    seen = []
+
+    def cancel_after_ten(message):
+        seen.append(message)
+        return len(seen) == 10
+
+    assert not reader.read_image('A', 'ibm.1440', out, callback=cancel_after_ten, **READ)
+    assert checkpoint_file(out).exists()
+    assert not out.exists() or not out.stat().st_size
+
+    resumed = []
+    assert reader.read_image('A', 'ibm.1440', out, resume=True,
+                             callback=lambda m: resumed.append(dict(m)) and False, **READ)
+    restored = [m for m in resumed if m['message'] == 'restored track from checkpoint']
+    assert [(m['logical_cylinder'], m['head']) for m in restored] == \
+        [(m['logical_cylinder'], m['head']) for m in seen]
+    assert len(resumed) == 160
+    assert out.read_bytes() == (SAMPLES / "ibm_1440.img").read_bytes()
+    assert not checkpoint_file(out).exists()
+
+
+def test_flux_stream_replays_the_read(make_reader, tmp_path):
+    import fluxstream
+    reader = make_reader(SAMPLES / "ibm_720.img", "ibm.720", "3.5DD")
+    first = tmp_path / "first.img"
+    flux_file = tmp_path / f"first.img{fluxstream.SUFFIX}"
+    assert reader.read_image('A', 'ibm.720', first, flux_file=flux_file, **READ)
+
+    records = list(fluxstream.read_flux_stream(flux_file))
+    assert [(r.cyl, r.head) for r in records] == [(c, h) for c in range(80) for h in range(2)]
+    assert all(r.attempt == 0 for r in records)
+
+    # the recorded flux, served back by the simulator, reads the same image
+    replay = make_reader(flux_file, 'ibm.720', "3.5DD")
+    second = tmp_path / "second.img"
+    assert replay.read_image('A', 'ibm.720', second, **READ)
+    assert second.read_bytes() == first.read_bytes() == (SAMPLES / "ibm_720.img").read_bytes()
+
+
+def test_adaptive_reads_fewer_revolutions(make_reader, tmp_path):
+    reader = make_reader(SAMPLES / "amiga_amigados.adf", "amiga.amigados", "3.5DD")
+    unit = reader.gw
+    read_track = unit.read_track
+    captured = {}
+    for adaptive in (False, True):
+        revs = captured[adaptive] = []
+
+        def counting(nr_revs, ticks=0):
+            # a ticks limit stops the capture partway through the last revolution
+            revs.append(ticks / (unit.rev_time * unit.sample_freq) if ticks else nr_revs)
+            return read_track(nr_revs, ticks=ticks)
+
+        unit.read_track = counting
+        out = tmp_path / f"{adaptive}.adf"
+        assert reader.read_image('A', 'amiga.amigados', out, adaptive=adaptive, **READ)
+        assert out.read_bytes() == (SAMPLES / "amiga_amigados.adf").read_bytes()
+    # every track reads cleanly on its first, shorter capture
+    assert len(captured[True]) == len(captured[False]) == 160
+    assert sum(captured[True]) < sum(captured[False])